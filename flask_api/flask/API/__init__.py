@@ -1,5 +1,6 @@
 from flask import Flask, current_app
 import docker, os
+from .collector import ProcCollector
 def init_stats():
 	try:
 		client=docker.from_env()
@@ -17,4 +18,9 @@ def create_API():
 	API.register_blueprint(main_blueprint)
 	with API.app_context():
 		init_stats()
+	# comma separated, e.g. COLLECTOR_DEVICES=sda,sdb, set to empty to take every disk or interface
+	API.collector=ProcCollector(interval=int(os.environ.get("COLLECTOR_INTERVAL",5)),
+		devices=[x for x in os.environ.get("COLLECTOR_DEVICES","sda").split(",") if x],
+		interfaces=[x for x in os.environ.get("COLLECTOR_INTERFACES","ens3").split(",") if x])
+	API.collector.start()
 	return API
\ No newline at end of file
@@ -0,0 +1,108 @@
+import collections, os, threading, time
+# samples /proc every `interval` seconds into a ring buffer, with the Metricbeat field names so the manager
+# computes the same statistics as from Elasticsearch
+FIELDS={
+	"cpu":["system.cpu.user.ticks","system.cpu.nice.ticks","system.cpu.system.ticks","system.cpu.idle.ticks",
+		"system.cpu.iowait.ticks","system.cpu.irq.ticks","system.cpu.softirq.ticks","system.cpu.steal.ticks"],
+	"diskio":["system.diskio.read.count","system.diskio.read.bytes","system.diskio.read.time",
+		"system.diskio.write.count","system.diskio.write.bytes","system.diskio.write.time",
+		"system.diskio.iostat.read.request.merges_per_sec","system.diskio.iostat.write.request.merges_per_sec"],
+	"network":["system.network.in.bytes","system.network.out.bytes"],
+	"process_summary":["system.process.summary.running"],
+	"memory":["system.memory.actual.used.bytes","system.memory.actual.used.pct"],
+}
+class ProcCollector:
+	# devices and interfaces match diskio.include_devices and interfaces of yml/system.yml, so the samples
+	# add up the same traffic Metricbeat reports. An empty list takes every whole disk or every interface but lo
+	def __init__(self,interval=5,capacity=720,devices=("sda",),interfaces=("ens3",)):
+		self.interval=interval
+		self.devices=devices
+		self.interfaces=interfaces
+		self.samples=collections.deque(maxlen=capacity)
+		self.lock=threading.Lock()
+		self.last_merges=None
+		self.thread=None
+	def start(self):
+		self.thread=threading.Thread(target=self.run)
+		self.thread.setDaemon(True)
+		self.thread.start()
+	def run(self):
+		while True:
+			started=time.time()
+			try:
+				sample=self.sample(started)
+				with self.lock:
+					self.samples.append((started,sample))
+			except (IOError,OSError,ValueError,IndexError):
+				pass
+			time.sleep(max(self.interval-(time.time()-started),0))
+	def sample(self,now):
+		return {"cpu":read_cpu(),"diskio":self.read_diskio(now),"network":read_network(self.interfaces),
+			"process_summary":read_process_summary(),"memory":read_memory()}
+	def read_diskio(self,now):
+		counters=read_diskstats(self.devices)
+		# Metricbeat reports merges as a rate, computed here from the previous sample
+		merges=(now,counters[6],counters[7])
+		rates=[0.0,0.0]
+		if(self.last_merges!=None and now>self.last_merges[0]):
+			rates=[(merges[i]-self.last_merges[i])/(now-self.last_merges[0]) for i in (1,2)]
+		self.last_merges=merges
+		return counters[:6]+rates
+	def todict(self,since=None,window=None):
+		now=time.time()
+		with self.lock:
+			samples=[(t,s) for t,s in self.samples if (since==None or t>since) and (window==None or t>=now-window)]
+		data={}
+		for metricset in FIELDS:
+			data[metricset]={"fields":FIELDS[metricset],"timestamps":[t for t,s in samples],
+				"samples":[s[metricset] for t,s in samples]}
+		return {"period":self.interval,"metricsets":data}
+def read_cpu():
+	with open("/proc/stat") as f:
+		for line in f:
+			if(line.startswith("cpu ")):
+				return [float(x) for x in line.split()[1:9]]
+	raise ValueError("No cpu line in /proc/stat")
+def read_diskstats(devices=None):
+	# the given devices, or all whole disks as partitions would count their I/O twice
+	totals=[0.0]*8
+	with open("/proc/diskstats") as f:
+		for line in f:
+			parts=line.split()
+			name=parts[2]
+			if(devices):
+				if(name not in devices):
+					continue
+			elif(name.startswith("loop") or name.startswith("ram") or not os.path.exists("/sys/block/"+name)):
+				continue
+			reads,reads_merged,sectors_read,read_time=[float(x) for x in parts[3:7]]
+			writes,writes_merged,sectors_written,write_time=[float(x) for x in parts[7:11]]
+			values=[reads,sectors_read*512,read_time,writes,sectors_written*512,write_time,reads_merged,writes_merged]
+			totals=[a+b for a,b in zip(totals,values)]
+	return totals
+def read_network(interfaces=None):
+	received=0.0
+	sent=0.0
+	with open("/proc/net/dev") as f:
+		for line in f:
+			if(":" not in line):
+				continue
+			name,data=line.split(":",1)
+			name=name.strip()
+			if((interfaces and name not in interfaces) or (not interfaces and name=="lo")):
+				continue
+			parts=data.split()
+			received+=float(parts[0])
+			sent+=float(parts[8])
+	return [received,sent]
+def read_process_summary():
+	with open("/proc/loadavg") as f:
+		return [float(f.read().split()[3].split("/")[0])]
+def read_memory():
+	info={}
+	with open("/proc/meminfo") as f:
+		for line in f:
+			key,value=line.split(":",1)
+			info[key]=float(value.split()[0])*1024
+	used=info["MemTotal"]-info["MemAvailable"]
+	return [used,used/info["MemTotal"]]
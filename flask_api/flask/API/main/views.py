@@ -9,6 +9,17 @@ def default():
 @main.route('/stats', methods=['GET'])
 def getstats():
 	return jsonify({"status":"Error","status_code":400,"target":"Get Stats","msg":"Deprecated method"})
+@main.route('/metrics', methods=['GET'])
+def getmetrics():
+	# samples of the node collector, newer than `since` and within the last `window` seconds
+	try:
+		since=float(request.args["since"]) if("since" in request.args) else None
+		window=float(request.args["window"]) if("window" in request.args) else None
+	except ValueError:
+		raise APIError(code=2400,target="Get Metrics")
+	data=current_app.collector.todict(since,window)
+	data["hostname"]=socket.gethostname()
+	return jsonify(data)
 @main.route('/container', methods=['GET','POST'])
 def container():
 	if(request.method=='GET'):
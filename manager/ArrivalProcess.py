@@ -0,0 +1,183 @@
+import itertools
+import json
+import random
+
+
+class ConstantArrival(object):
+    def __init__(self, rps):
+        self.rps = rps
+
+    def offsets(self):
+        # seconds from the start of the phase at which each request should be sent
+        for sent in itertools.count():
+            yield sent / self.rps
+
+    def split(self, n):
+        return [ConstantArrival(self.rps / n) for _ in range(n)]
+
+    def spec(self):
+        return {'arrival_process': 'constant', 'rps': self.rps, 'arrival_kwargs': {}}
+
+
+class PoissonArrival(object):
+    def __init__(self, rps, seed=None):
+        self.rps = rps
+        self.seed = seed
+
+    def offsets(self):
+        rng = random.Random(self.seed)
+        offset = 0.0
+        while True:
+            yield offset
+            offset += rng.expovariate(self.rps)
+
+    def split(self, n):
+        # a superposition of independent Poisson processes is Poisson again
+        return [PoissonArrival(self.rps / n, seed=None if self.seed is None else '{0}-{1}'.format(self.seed, i))
+                for i in range(n)]
+
+    def spec(self):
+        return {'arrival_process': 'poisson', 'rps': self.rps, 'arrival_kwargs': {'seed': self.seed}}
+
+
+class MMPPArrival(object):
+    """Markov-modulated Poisson process.
+
+    The process stays in state i for an exponential time with mean `mean_durations[i]` seconds
+    and sends at `rates[i]` requests per second meanwhile, then moves to another state picked at
+    random. Two states, e.g. rates=[10, 200], give an on/off bursty load.
+    """
+    def __init__(self, rates, mean_durations, seed=None, shard=None):
+        if len(rates) != len(mean_durations) or len(rates) < 2:
+            raise Exception('MMPP needs matching rates and mean_durations for at least two states!')
+        self.rates = list(rates)
+        self.mean_durations = list(mean_durations)
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.shard = shard
+        self.rps = sum(r * d for r, d in zip(self.rates, self.mean_durations)) / sum(self.mean_durations)
+
+    def offsets(self):
+        # states are drawn from the seed alone, so every shard of a split process switches together
+        state_rng = random.Random(self.seed)
+        arrival_rng = random.Random('{0}-{1}'.format(self.seed, self.shard))
+        state = 0
+        state_start = 0.0
+        while True:
+            state_end = state_start + state_rng.expovariate(1.0 / self.mean_durations[state])
+            rate = self.rates[state]
+            if rate > 0:
+                offset = state_start + arrival_rng.expovariate(rate)
+                while offset < state_end:
+                    yield offset
+                    offset += arrival_rng.expovariate(rate)
+            state_start = state_end
+            state = state_rng.choice([i for i in range(len(self.rates)) if i != state])
+
+    def scaled(self, rps):
+        # same states and switching, every rate scaled so the mean is rps
+        return MMPPArrival([r * rps / self.rps for r in self.rates], self.mean_durations, seed=self.seed,
+                           shard=self.shard)
+
+    def split(self, n):
+        return [MMPPArrival([r / n for r in self.rates], self.mean_durations, seed=self.seed, shard=i)
+                for i in range(n)]
+
+    def spec(self):
+        return {'arrival_process': 'mmpp', 'rps': self.rps,
+                'arrival_kwargs': {'rates': self.rates, 'mean_durations': self.mean_durations, 'seed': self.seed,
+                                   'shard': self.shard}}
+
+
+class TraceArrival(object):
+    """Replays the send times recorded in a trace file.
+
+    Each line is either a JSON object holding `time_key` or a bare number. Times are in seconds
+    unless `time_scale` says otherwise (0.001 for milliseconds), and are replayed relative to the
+    first line. The file is read lazily, one line at a time.
+    """
+    def __init__(self, path, time_key='timestamp', time_scale=1.0, speedup=1.0, shard=None):
+        self.path = path
+        self.time_key = time_key
+        self.time_scale = time_scale
+        self.speedup = speedup
+        # (i, n) keeps every n-th record starting at i
+        self.shard = shard
+        self.rps = None
+
+    def parse_time(self, line):
+        if line.startswith('{'):
+            return float(json.loads(line)[self.time_key])
+        return float(line)
+
+    def offsets(self):
+        first = None
+        with open(self.path) as f:
+            for idx, line in enumerate(line for line in f if line.strip()):
+                if first is None:
+                    first = self.parse_time(line.strip())
+                if self.shard is not None and idx % self.shard[1] != self.shard[0]:
+                    continue
+                timestamp = self.parse_time(line.strip())
+                yield (timestamp - first) * self.time_scale / self.speedup
+
+    def mean_rps(self):
+        # rate of the whole trace at the current speedup, None when it spans no time
+        count = 0
+        first = None
+        last = None
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                timestamp = self.parse_time(line.strip())
+                first = timestamp if first is None else first
+                last = timestamp
+                count += 1
+        if count < 2 or last <= first:
+            return None
+        return (count - 1) / ((last - first) * self.time_scale / self.speedup)
+
+    def scaled(self, rps):
+        # the trace sped up or slowed down so its mean is rps
+        mean_rps = self.mean_rps()
+        if mean_rps is None:
+            return self
+        arrival = TraceArrival(self.path, self.time_key, self.time_scale, self.speedup * rps / mean_rps, self.shard)
+        arrival.rps = rps
+        return arrival
+
+    def split(self, n):
+        return [TraceArrival(self.path, self.time_key, self.time_scale, self.speedup, shard=(i, n)) for i in range(n)]
+
+    def spec(self):
+        # the trace file has to exist at the same path wherever the spec is rebuilt
+        return {'arrival_process': 'trace', 'rps': None,
+                'arrival_kwargs': {'path': self.path, 'time_key': self.time_key, 'time_scale': self.time_scale,
+                                   'speedup': self.speedup, 'shard': self.shard}}
+
+
+def create_arrival(arrival_process, rps, **kwargs):
+    # 'mmpp' and 'trace' take their rates from kwargs and ignore rps
+    if arrival_process == 'constant':
+        return ConstantArrival(rps)
+    elif arrival_process == 'poisson':
+        return PoissonArrival(rps, **kwargs)
+    elif arrival_process == 'mmpp':
+        return MMPPArrival(**kwargs)
+    elif arrival_process == 'trace':
+        return TraceArrival(**kwargs)
+    else:
+        raise Exception("Invalid Arrival Process!!!")
+
+
+def create_scaled_arrival(arrival_process, rps, **kwargs):
+    # like create_arrival, but 'mmpp' and 'trace' keep their shape from kwargs and are scaled to a mean of rps
+    arrival = create_arrival(arrival_process, rps, **kwargs)
+    if arrival_process in ['mmpp', 'trace']:
+        arrival = arrival.scaled(rps)
+    return arrival
+
+
+def arrival_from_spec(spec):
+    # inverse of the spec() methods, used to ship arrival processes as JSON
+    return create_arrival(spec['arrival_process'], spec['rps'], **spec['arrival_kwargs'])
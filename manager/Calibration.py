@@ -0,0 +1,205 @@
+"""
+Measures what the load generator itself can deliver, against a local no-op HTTP server.
+
+    python Calibration.py [calibration.json]
+
+RPS mode is ramped until the achieved rate falls behind the requested one, Interactive mode until
+more clients no longer add throughput. The report holds the maximum sustainable rate, the latency
+the generator adds on its own and the generator CPU time per request. Pass it to Manager as
+generator_calibration to get a warning when a test asks for more than that.
+"""
+import asyncio
+import json
+import multiprocessing
+import socket
+import sys
+import time
+
+import LoadTester
+
+NOOP_RESPONSE = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nContent-Type: text/plain\r\n\r\nok'
+
+
+async def handle_noop(reader, writer):
+    try:
+        while True:
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(NOOP_RESPONSE)
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def run_noop_server(port, ready):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # every server process listens on the same port, the kernel spreads the connections
+    server = loop.run_until_complete(asyncio.start_server(handle_noop, '127.0.0.1', port, reuse_port=True,
+                                                          backlog=1024))
+    ready.set()
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
+        loop.close()
+
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_noop_server(processes=2):
+    # separate processes, so the server doesn't compete with the generator for the GIL
+    port = free_port()
+    servers = []
+    for i in range(processes):
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(target=run_noop_server, args=(port, ready), daemon=True)
+        server.start()
+        ready.wait(10)
+        servers.append(server)
+    return 'http://127.0.0.1:{0}/'.format(port), servers
+
+
+def stop_noop_server(servers):
+    for server in servers:
+        server.terminate()
+        server.join()
+
+
+def run_step(url, step_time, warmup_time, rps=None, num_of_clients=None, **tester_kwargs):
+    if rps is not None:
+        load_tester = LoadTester.LoadTester(url, timeout=step_time, warmup=warmup_time, **tester_kwargs)
+    else:
+        load_tester = LoadTester.LoadTester(url, timeout=step_time, warmup=warmup_time,
+                                            num_of_clients=num_of_clients, **tester_kwargs)
+
+    # process_time() counts the CPU of every thread of this process, warmup included
+    cpu_start = time.process_time()
+    if rps is not None:
+        load_tester.perform_test_rps_async(rps=rps)
+        load_tester.wait_for_test_results()
+    else:
+        load_tester.perform_test()
+    cpu_time = time.process_time() - cpu_start
+
+    results = load_tester.results()
+    warmup_requests = results['rps'] * LoadTester.convert_to_seconds(warmup_time)
+    requests = results['completed'] + results['failed'] + warmup_requests
+    results['cpu_ms_per_request'] = cpu_time * 1000 / requests if requests > 0 else 0
+    results['requested_rps'] = rps
+    results['num_of_clients'] = num_of_clients
+    return results
+
+
+def sustained(step, tolerance, max_intended_p99_ms):
+    # requests sent late pile up in intended_p99 long before the completed count falls behind
+    return (step['rps'] >= step['requested_rps'] * tolerance and step['failed'] == 0 and
+            step['intended_p99_ms'] <= max_intended_p99_ms)
+
+
+def calibrate_rps(url, start_rps=100, max_rps=50000, step_factor=2, step_time='5s', warmup_time='1s',
+                  tolerance=0.95, max_intended_p99_ms=50, **tester_kwargs):
+    # ramps until the generator can't keep the requested rate
+    steps = []
+    rps = start_rps
+    while rps <= max_rps:
+        print('calibrating RPS mode at', rps, 'rps')
+        results = run_step(url, step_time, warmup_time, rps=rps, **tester_kwargs)
+        steps.append(results)
+        if not sustained(results, tolerance, max_intended_p99_ms):
+            break
+        rps *= step_factor
+
+    good_steps = [step for step in steps if sustained(step, tolerance, max_intended_p99_ms)]
+    best = max(good_steps, key=lambda step: step['rps']) if good_steps else steps[0]
+    return {
+        'max_rps': best['rps'] if good_steps else 0,
+        # against a no-op server all of the service time is the generator and the loopback
+        'added_latency_ms': steps[0]['p50_ms'],
+        'added_p99_ms': steps[0]['p99_ms'],
+        'cpu_ms_per_request': best['cpu_ms_per_request'],
+        'steps': steps,
+    }
+
+
+def calibrate_interactive(url, start_clients=1, max_clients=512, step_factor=2, step_time='5s', warmup_time='1s',
+                          min_gain=1.05, patience=2, **tester_kwargs):
+    # ramps until more clients add less than min_gain throughput for `patience` steps in a row
+    steps = []
+    num_of_clients = start_clients
+    best_rps = 0
+    no_gain = 0
+    while num_of_clients <= max_clients and no_gain < patience:
+        print('calibrating Interactive mode with', num_of_clients, 'clients')
+        results = run_step(url, step_time, warmup_time, num_of_clients=num_of_clients, **tester_kwargs)
+        steps.append(results)
+        no_gain = no_gain + 1 if results['rps'] < best_rps * min_gain else 0
+        best_rps = max(best_rps, results['rps'])
+        num_of_clients *= step_factor
+
+    best = max(steps, key=lambda step: step['rps'])
+    return {
+        'max_rps': best['rps'],
+        'max_clients': best['num_of_clients'],
+        'added_latency_ms': steps[0]['p50_ms'],
+        'added_p99_ms': steps[0]['p99_ms'],
+        'cpu_ms_per_request': best['cpu_ms_per_request'],
+        'steps': steps,
+    }
+
+
+def calibrate(step_time='5s', warmup_time='1s', server_processes=2, rps_kwargs=None, interactive_kwargs=None,
+              **tester_kwargs):
+    """Ramps a LoadTester against a local no-op server in RPS and Interactive mode.
+
+    tester_kwargs go to every LoadTester, e.g. engine='thread' or keep_alive=False, so the
+    calibration matches the settings the experiments run with.
+    """
+    if rps_kwargs is None:
+        rps_kwargs = {}
+    if interactive_kwargs is None:
+        interactive_kwargs = {}
+
+    url, servers = start_noop_server(server_processes)
+    try:
+        calibration = {
+            'RPS': calibrate_rps(url, step_time=step_time, warmup_time=warmup_time,
+                                 **dict(tester_kwargs, **rps_kwargs)),
+            'Interactive': calibrate_interactive(url, step_time=step_time, warmup_time=warmup_time,
+                                                 **dict(tester_kwargs, **interactive_kwargs)),
+            'tester_kwargs': tester_kwargs,
+        }
+    finally:
+        stop_noop_server(servers)
+    return calibration
+
+
+def print_calibration(calibration):
+    for test_mode in ['RPS', 'Interactive']:
+        mode = calibration[test_mode]
+        print('{0}: max {1:4.02f} rps, added latency p50 {2:4.03f} ms, p99 {3:4.03f} ms, '
+              'CPU {4:4.03f} ms per request'.format(test_mode, mode['max_rps'], mode['added_latency_ms'],
+                                                    mode['added_p99_ms'], mode['cpu_ms_per_request']))
+
+
+def save_calibration(calibration, path):
+    with open(path, 'w') as f:
+        json.dump(calibration, f, indent=2)
+
+
+def load_calibration(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    calibration = calibrate()
+    print_calibration(calibration)
+    if len(sys.argv) > 1:
+        save_calibration(calibration, sys.argv[1])
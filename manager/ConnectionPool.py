@@ -0,0 +1,130 @@
+import asyncio
+import collections
+import http.client
+import select
+import threading
+
+
+def new_connection(o, sock_timeout):
+    if o.scheme == 'https':
+        return http.client.HTTPSConnection(o.netloc, timeout=sock_timeout)
+    else:
+        return http.client.HTTPConnection(o.netloc, timeout=sock_timeout)
+
+
+def is_stale(conn):
+    # An idle keep-alive socket has nothing to read, so a readable one was closed by the server
+    # (or holds junk) and can't be reused
+    if conn.sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return len(readable) > 0
+
+
+class ConnectionPool(object):
+    """Keep-alive http.client connections shared by all ClientThreads of a LoadTester.
+
+    At most `max_idle` idle connections are kept per host, max_idle=0 turns reuse off. A request
+    on a reused connection that turns out to be closed is retried once on a new connection.
+    """
+    stale_errors = (http.client.RemoteDisconnected, http.client.BadStatusLine, http.client.CannotSendRequest,
+                    ConnectionResetError, BrokenPipeError)
+
+    def __init__(self, max_idle=100, sock_timeout=10):
+        self.max_idle = max_idle
+        self.sock_timeout = sock_timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, o):
+        key = (o.scheme, o.netloc)
+        with self.lock:
+            idle = self.idle.get(key)
+            while idle:
+                conn = idle.pop()
+                if not is_stale(conn):
+                    return conn, True
+                conn.close()
+        return new_connection(o, self.sock_timeout), False
+
+    def release(self, o, conn, response=None):
+        if response is not None and response.will_close:
+            conn.close()
+            return
+        key = (o.scheme, o.netloc)
+        with self.lock:
+            idle = self.idle.setdefault(key, collections.deque())
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, o, method, path):
+        # returns the connection with its response, the caller reads the body and releases it
+        conn, reused = self.acquire(o)
+        try:
+            conn.request(method, path)
+            return conn, conn.getresponse()
+        except self.stale_errors:
+            conn.close()
+            if not reused:
+                raise
+        except BaseException:
+            conn.close()
+            raise
+
+        conn = new_connection(o, self.sock_timeout)
+        try:
+            conn.request(method, path)
+            return conn, conn.getresponse()
+        except BaseException:
+            conn.close()
+            raise
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for conn in idle:
+                    conn.close()
+            self.idle = {}
+
+
+class AsyncConnectionPool(object):
+    """Keep-alive asyncio streams, the event loop counterpart of ConnectionPool."""
+    def __init__(self, max_idle=100, sock_timeout=10):
+        self.max_idle = max_idle
+        self.sock_timeout = sock_timeout
+        self.idle = {}
+
+    async def acquire(self, o):
+        key = (o.scheme, o.netloc)
+        idle = self.idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if reader.at_eof() or writer.transport.is_closing():
+                writer.close()
+                continue
+            return reader, writer, True
+
+        port = o.port or (443 if o.scheme == 'https' else 80)
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(o.hostname, port,
+                                                                        ssl=(o.scheme == 'https')),
+                                                self.sock_timeout)
+        return reader, writer, False
+
+    def release(self, o, reader, writer, keep_alive=True):
+        key = (o.scheme, o.netloc)
+        idle = self.idle.setdefault(key, collections.deque())
+        if keep_alive and len(idle) < self.max_idle:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    def close(self):
+        for idle in self.idle.values():
+            for reader, writer in idle:
+                writer.close()
+        self.idle = {}
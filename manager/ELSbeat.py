@@ -1,237 +1,615 @@
+from collections import namedtuple
+
 from elasticsearch import Elasticsearch
 import numpy as np
 import time
 
+# fields are summed when there is more than one, counters are differenced between samples, values are multiplied
+# by scale at the end
+MetricSpec = namedtuple("MetricSpec", ["name", "metricset", "fields", "counter", "scale"])
+
+METRIC_SPECS = [
+    MetricSpec("cpu_time", "cpu", ["system.cpu.user.ticks", "system.cpu.system.ticks", "system.cpu.idle.ticks",
+                                   "system.cpu.iowait.ticks", "system.cpu.softirq.ticks", "system.cpu.nice.ticks",
+                                   "system.cpu.irq.ticks", "system.cpu.steal.ticks"], True, 1.0),
+    MetricSpec("cpu_usr", "cpu", ["system.cpu.user.ticks"], True, 1.0),
+    MetricSpec("cpu_krn", "cpu", ["system.cpu.system.ticks"], True, 1.0),
+    MetricSpec("cpu_idle", "cpu", ["system.cpu.idle.ticks"], True, 1.0),
+    MetricSpec("cpu_io_wait", "cpu", ["system.cpu.iowait.ticks"], True, 1.0),
+    MetricSpec("cpu_sint_time", "cpu", ["system.cpu.softirq.ticks"], True, 1.0),
+    MetricSpec("dsr", "diskio", ["system.diskio.read.bytes"], True, 1 / 512.0),
+    MetricSpec("dsreads", "diskio", ["system.diskio.read.count"], True, 1.0),
+    MetricSpec("drm", "diskio", ["system.diskio.iostat.read.request.merges_per_sec"], False, 1.0),
+    MetricSpec("readtime", "diskio", ["system.diskio.read.time"], True, 1.0),
+    MetricSpec("dsw", "diskio", ["system.diskio.write.bytes"], True, 1 / 512.0),
+    MetricSpec("dswrites", "diskio", ["system.diskio.write.count"], True, 1.0),
+    MetricSpec("dwm", "diskio", ["system.diskio.iostat.write.request.merges_per_sec"], False, 1.0),
+    MetricSpec("writetime", "diskio", ["system.diskio.write.time"], True, 1.0),
+    MetricSpec("nbr", "network", ["system.network.out.bytes"], True, 1.0),
+    MetricSpec("nbs", "network", ["system.network.in.bytes"], True, 1.0),
+    MetricSpec("loadavg", "process_summary", ["system.process.summary.running"], False, 1.0),
+    MetricSpec("mem_used_bytes", "memory", ["system.memory.actual.used.bytes"], False, 1.0),
+    MetricSpec("mem_used_pct", "memory", ["system.memory.actual.used.pct"], False, 1.0),
+]
+
+# keyword fields that tell apart the documents one metricset writes at the same @timestamp, e.g. one per disk.
+# Keywords have doc values, so unlike _id they sort without fielddata
+SORT_TIEBREAKS = {
+    ("system", "diskio"): ["system.diskio.name"],
+    ("system", "network"): ["system.network.name"],
+    ("docker", "network"): ["docker.container.id", "docker.network.interface"],
+}
+DOCKER_SORT_TIEBREAK = ["docker.container.id"]
+
+# Docker module metrics of every container, the network ones are per interface and summed up per container
+CONTAINER_METRIC_SPECS = [
+    MetricSpec("container_cpu_pct", "cpu", ["docker.cpu.total.pct"], False, 1.0),
+    MetricSpec("container_cpu_usr_pct", "cpu", ["docker.cpu.user.pct"], False, 1.0),
+    MetricSpec("container_cpu_krn_pct", "cpu", ["docker.cpu.kernel.pct"], False, 1.0),
+    MetricSpec("container_mem_used_bytes", "memory", ["docker.memory.usage.total"], False, 1.0),
+    MetricSpec("container_mem_used_pct", "memory", ["docker.memory.usage.pct"], False, 1.0),
+    MetricSpec("container_mem_rss_bytes", "memory", ["docker.memory.rss.total"], False, 1.0),
+    MetricSpec("container_dsr", "diskio", ["docker.diskio.read.bytes"], True, 1 / 512.0),
+    MetricSpec("container_dsreads", "diskio", ["docker.diskio.read.ops"], True, 1.0),
+    MetricSpec("container_dsw", "diskio", ["docker.diskio.write.bytes"], True, 1 / 512.0),
+    MetricSpec("container_dswrites", "diskio", ["docker.diskio.write.ops"], True, 1.0),
+    MetricSpec("container_nbr", "network", ["docker.network.outbound.bytes"], True, 1.0),
+    MetricSpec("container_nbs", "network", ["docker.network.inbound.bytes"], True, 1.0),
+]
+
 
 class metricbeat:
-    def __init__(self, ELSaddress, ELSport, worker_node_hostname):
+    def __init__(self, ELSaddress, ELSport, worker_node_hostname, page_size=500, period=5, max_gap=2.5):
         self.hostname = worker_node_hostname
-        self.es = Elasticsearch([{"host": ELSaddress, "port": ELSport}])
+        # Metricbeat period in seconds, counters are reported as increase per period. Intervals longer
+        # than max_gap periods are dropped events and are left out
+        self.period = period
+        self.max_gap = max_gap
+        # samples per metricset fetched by one search, longer windows are paged through with search_after
+        self.page_size = page_size
+        # no client without an address, for backends that override FetchSamples
+        self.es = None if ELSaddress is None else Elasticsearch([{"host": ELSaddress, "port": ELSport}])
+        # turned off when Elasticsearch rejects sorting on the tiebreak fields, e.g. without the Metricbeat template
+        self.sort_tiebreaks = True
         self.system_modules = ["cpu", "diskio", "network", "process_summary","memory"]
+        self.container_modules = ["cpu", "memory", "diskio", "network"]
         self.stats = {"avg": 0, "min": 0, "max": 0, "std": 0, "percentile5": 0, "percentile95": 0}
         self.statistics_list = ["cpu_time", "cpu_usr", "cpu_krn", "cpu_idle", "cpu_io_wait", "cpu_sint_time", "dsr",
                                 "dsreads", "drm", "readtime", "dsw", "dswrites", "dwm", "writetime", "nbr", "nbs",
                                 "loadavg","mem_used_bytes","mem_used_pct"]
 
-    def QuerySysteMmodule(self, start_time="now-1m", duration_in_seconds=0, wait=False):
+    def SystemQuery(self, hostname, metricset, start_time="now-1m", search_after=None, module="system",
+                    fields=None):
+        # the tiebreak fields break @timestamp ties, so search_after resumes exactly after the last sample of
+        # the previous page. Without them samples sharing the page's last @timestamp may be skipped
+        if fields is None:
+            fields = self.MetricsetFields(metricset)
         query_body = {
             "query": {
                 "bool": {
                     "must": [
-                        {"match": {"host.name": self.hostname}},
-                        {"match": {"metricset.module": "system"}},
-                        {"match": {"metricset.name": "cpu"}}
+                        {"match": {"host.name": hostname}},
+                        {"match": {"metricset.module": module}},
+                        {"match": {"metricset.name": metricset}}
                     ],
                     "filter": [
                         {"range": {"@timestamp": {"gte": start_time}}}
                     ]
                 }
             },
-            "sort": [
-                {"@timestamp": "asc"}
-            ]
+            "sort": [{"@timestamp": "asc"}] + [{field: "asc"} for field in self.SortTiebreak(module, metricset)],
+            "_source": ["@timestamp"] + fields,
+            "size": self.page_size
         }
-        res_dict = {}
+        if search_after is not None:
+            # sort values from before the tiebreaks were turned off have more values than the sort
+            query_body["search_after"] = search_after[:len(query_body["sort"])]
+        return query_body
+
+    def SortTiebreak(self, module, metricset):
+        if not self.sort_tiebreaks:
+            return []
+        if module == "docker":
+            return SORT_TIEBREAKS.get((module, metricset), DOCKER_SORT_TIEBREAK)
+        return SORT_TIEBREAKS.get((module, metricset), [])
+
+    def QuerySystemModules(self, hostnames, start_time="now-1m", duration_in_seconds=0, wait=False):
+        # (timestamps, samples array) of every metricset of every host, {host: {metricset: (timestamps, samples)}}
         if (wait == True):
             time.sleep(duration_in_seconds)
-        for item in self.system_modules:
-            query_body["query"]["bool"]["must"][2]["match"]["metricset.name"] = item
-            res_dict[item] = self.es.search(doc_type="doc", body=query_body, size=60)["hits"]
-        return res_dict
+        keys = [(hostname, item) for hostname in hostnames for item in self.system_modules]
+        fetched = self.FetchSamples(keys, start_time)
+
+        res = {}
+        for hostname in hostnames:
+            res[hostname] = {}
+        for (hostname, item), result in fetched.items():
+            res[hostname][item] = None if result is None else result[:2]
+        return res
+
+    def FetchSamples(self, keys, start_time="now-1m", search_after=None):
+        """Pages through the samples of every (hostname, metricset) of keys with SearchPages.
 
-    def GetStatistics(self, start_time="now-1m", duration_in_seconds=0, wait=False):
+        The round trips grow with the window and not with the number of hosts. Pages are turned
+        into arrays as they arrive and only the arrays are kept. search_after may hold the
+        sort values to start after per key. Returns {key: (timestamps, samples, last sort values)},
+        with None for a failed search.
+
+        This is the only method that talks to Elasticsearch when the statistics are computed here,
+        another metrics backend overrides it, see ProcMetrics.
+        """
+        pages = {}
+        timestamps = {}
+        after = {}
+        queries = {}
+        for key in keys:
+            pages[key] = []
+            timestamps[key] = []
+            after[key] = None if search_after is None else search_after.get(key)
+            queries[key] = lambda after_key, key=key: self.SystemQuery(key[0], key[1], start_time, after_key)
+
+        for key, hits in self.SearchPages(queries, after):
+            if hits is None or pages[key] is None:
+                pages[key] = None
+                continue
+            try:
+                pages[key].append(self.MetricsetArray(key[1], hits))
+                timestamps[key].append(hit_timestamps(hits))
+            except (KeyError, TypeError, ValueError):
+                # a malformed document only costs the statistics of its own host
+                pages[key] = None
+                continue
+            if hits:
+                after[key] = hits[-1]["sort"]
+
+        res = {}
+        for key in keys:
+            if pages[key] is None:
+                res[key] = None
+            else:
+                res[key] = (np.concatenate(timestamps[key]), np.concatenate(pages[key]), after[key])
+        return res
+
+    def SearchPages(self, queries, search_after=None):
+        """Yields (key, hits) for every page of every query, hits is None when the search failed.
+
+        queries maps every key to a function building its query body from the sort values to search
+        after. Each round trip is one msearch holding the next page of every key that still has
+        documents left.
+        """
+        after = {}
+        for key in queries:
+            after[key] = None if search_after is None else search_after.get(key)
+
+        pending = list(queries.keys())
+        while pending:
+            body = []
+            for key in pending:
+                body.append({})
+                body.append(queries[key](after[key]))
+            responses = self.es.msearch(body=body, doc_type="doc")["responses"]
+
+            # whether this round's queries were built with the tiebreaks
+            tiebreaks = self.sort_tiebreaks
+            next_pending = []
+            for key, response in zip(pending, responses):
+                error = str(response.get("error", "")).lower()
+                if tiebreaks and ("sort" in error or "fielddata" in error):
+                    # the tiebreak fields can't be sorted on, page on @timestamp alone from now on
+                    if self.sort_tiebreaks:
+                        print("Sorting on the tiebreak fields was rejected, sorting on @timestamp only")
+                    self.sort_tiebreaks = False
+                    next_pending.append(key)
+                    continue
+                if "error" in response:
+                    yield key, None
+                    continue
+                hits = response["hits"]["hits"]
+                yield key, hits
+                if len(hits) == self.page_size:
+                    after[key] = hits[-1]["sort"]
+                    next_pending.append(key)
+            pending = next_pending
+
+    def QuerySysteMmodule(self, start_time="now-1m", duration_in_seconds=0, wait=False):
+        return self.QuerySystemModules([self.hostname], start_time, duration_in_seconds, wait)[self.hostname]
+
+    def EmptyStatistics(self):
         dic = {}
-        module_total = {}
         for item in self.statistics_list:
             dic[item] = {"avg": 0, "min": 0, "max": 0, "std": 0, "percentile5": 0, "percentile95": 0}
+        return dic
+
+    def GetStatistics(self, start_time="now-1m", duration_in_seconds=0, wait=False, server_side=False,
+                      interval="5s"):
+        # server_side=True has Elasticsearch compute the statistics with aggregations, see AggregationQuery
+        if server_side:
+            return self.GetHostsStatistics([self.hostname], start_time, duration_in_seconds, wait, server_side,
+                                           interval)[self.hostname]
         try:
             res_dict = self.QuerySysteMmodule(start_time, duration_in_seconds, wait)
+        except:
+            return self.EmptyStatistics()
+        return self.ComputeStatistics(res_dict, self.HostPeriod(self.hostname))
+
+    def GetHostsStatistics(self, hostnames, start_time="now-1m", duration_in_seconds=0, wait=False,
+                           server_side=False, interval="5s"):
+        # GetStatistics of several hosts at the cost of a single query
+        try:
+            if server_side:
+                res = self.QueryAggregations(hostnames, start_time, duration_in_seconds, wait, interval)
+            else:
+                res = self.QuerySystemModules(hostnames, start_time, duration_in_seconds, wait)
+        except:
+            return {hostname: self.EmptyStatistics() for hostname in hostnames}
+        if server_side:
+            return {hostname: self.ComputeAggregatedStatistics(res[hostname]) for hostname in hostnames}
+        return {hostname: self.ComputeStatistics(res[hostname], self.HostPeriod(hostname)) for hostname in hostnames}
+
+    def AggregationQuery(self, hostname, metricset, start_time="now-1m", interval="5s"):
+        """Statistics of every metric of the metricset computed by Elasticsearch, no documents are returned.
+
+        Samples are bucketed by `interval`, which should match the Metricbeat period so every bucket
+        holds one sample. Counters are differenced with a derivative and the bucket values are summed
+        up with extended_stats_bucket and percentiles_bucket.
+        """
+        query_body = self.SystemQuery(hostname, metricset, start_time)
+        query_body["size"] = 0
+        del query_body["sort"]
+        del query_body["_source"]
+
+        bucket_aggs = {}
+        aggs = {"series": {"date_histogram": {"field": "@timestamp", "interval": interval, "min_doc_count": 0},
+                           "aggs": bucket_aggs}}
+        for spec in METRIC_SPECS:
+            if spec.metricset != metricset:
+                continue
+            if len(spec.fields) == 1:
+                bucket_aggs[spec.name + "_value"] = {"max" if spec.counter else "avg": {"field": spec.fields[0]}}
+            else:
+                buckets_path = {}
+                for idx, field in enumerate(spec.fields):
+                    bucket_aggs["{0}_{1}".format(spec.name, idx)] = {"max": {"field": field}}
+                    buckets_path["v{0}".format(idx)] = "{0}_{1}".format(spec.name, idx)
+                script = " + ".join(["params." + key for key in sorted(buckets_path)])
+                bucket_aggs[spec.name + "_value"] = {"bucket_script": {"buckets_path": buckets_path,
+                                                                       "script": script}}
+            series = spec.name + "_value"
+            if spec.counter:
+                bucket_aggs[spec.name + "_rate"] = {"derivative": {"buckets_path": spec.name + "_value"}}
+                series = spec.name + "_rate"
+            aggs[spec.name + "_stats"] = {"extended_stats_bucket": {"buckets_path": "series>" + series}}
+            aggs[spec.name + "_percentiles"] = {"percentiles_bucket": {"buckets_path": "series>" + series,
+                                                                       "percents": [5, 95]}}
+        query_body["aggs"] = aggs
+        return query_body
+
+    def QueryAggregations(self, hostnames, start_time="now-1m", duration_in_seconds=0, wait=False, interval="5s"):
+        # like QuerySystemModules, but holds the aggregation results instead of the hits
+        if (wait == True):
+            time.sleep(duration_in_seconds)
+        body = []
+        keys = []
+        for hostname in hostnames:
             for item in self.system_modules:
-                if (res_dict[item]["total"] == 0):
+                body.append({})
+                body.append(self.AggregationQuery(hostname, item, start_time, interval))
+                keys.append((hostname, item))
+        responses = self.es.msearch(body=body, doc_type="doc")["responses"]
+
+        res = {}
+        for hostname in hostnames:
+            res[hostname] = {}
+        for (hostname, item), response in zip(keys, responses):
+            res[hostname][item] = None if "error" in response else response
+        return res
+
+    def ComputeAggregatedStatistics(self, res_dict):
+        dic = self.EmptyStatistics()
+        try:
+            for item in self.system_modules:
+                if (res_dict[item]["hits"]["total"] == 0):
+                    return dic
+        except:
+            return dic
+        for spec in METRIC_SPECS:
+            aggregations = res_dict[spec.metricset]["aggregations"]
+            stats = aggregations[spec.name + "_stats"]
+            if not stats["count"]:
+                continue
+            percentiles = aggregations[spec.name + "_percentiles"]["values"]
+            dic[spec.name] = {
+                "avg": stats["avg"] * spec.scale,
+                "min": stats["min"] * spec.scale,
+                "max": stats["max"] * spec.scale,
+                "std": stats["std_deviation"] * spec.scale,
+                "percentile5": percentiles["5.0"] * spec.scale,
+                "percentile95": percentiles["95.0"] * spec.scale,
+            }
+        return dic
+
+    def HostPeriod(self, hostname):
+        # sampling period of the host's counters, Metricbeat uses the same period on every host
+        return self.period
+
+    def ComputeStatistics(self, res_dict, period=None):
+        dic = self.EmptyStatistics()
+        try:
+            for item in self.system_modules:
+                if (res_dict[item][1].shape[0] == 0):
                     return dic
-                else:
-                    module_total[item] = res_dict[item]["total"]
         except:
             return dic
-        cpu_time_series = []
-        cpu_usr_series = []
-        cpu_krn_series = []
-        cpu_idle_series = []
-        cpu_io_wait_series = []
-        cpu_sint_time_series = []
-        for i in range(module_total["cpu"]):
-            cpu_usr_series.append(res_dict["cpu"]["hits"][i]["_source"]["system"]["cpu"]["user"]["ticks"])
-            cpu_krn_series.append(res_dict["cpu"]["hits"][i]["_source"]["system"]["cpu"]["system"]["ticks"])
-            cpu_idle_series.append(res_dict["cpu"]["hits"][i]["_source"]["system"]["cpu"]["idle"]["ticks"])
-            cpu_io_wait_series.append(res_dict["cpu"]["hits"][i]["_source"]["system"]["cpu"]["iowait"]["ticks"])
-            cpu_sint_time_series.append(res_dict["cpu"]["hits"][i]["_source"]["system"]["cpu"]["softirq"]["ticks"])
-            cpu_time_series.append(cpu_usr_series[i] + cpu_krn_series[i] + cpu_idle_series[i] + cpu_io_wait_series[i] +
-                                   cpu_sint_time_series[i] +
-                                   res_dict["cpu"]["hits"][i]["_source"]["system"]["cpu"]["nice"]["ticks"] +
-                                   res_dict["cpu"]["hits"][i]["_source"]["system"]["cpu"]["irq"]["ticks"] +
-                                   res_dict["cpu"]["hits"][i]["_source"]["system"]["cpu"]["steal"]["ticks"])
-        dsr_series = []
-        dsreads_series = []
-        drm_series = []
-        readtime_series = []
-        dsw_series = []
-        dswrites_series = []
-        dwm_series = []
-        writetime_series = []
-        for i in range(module_total["diskio"]):
-            dsr_series.append(res_dict["diskio"]["hits"][i]['_source']['system']["diskio"]["read"]["bytes"] / 512.0)
-            dsreads_series.append(res_dict["diskio"]["hits"][i]['_source']['system']["diskio"]["read"]["count"])
-            drm_series.append(res_dict["diskio"]["hits"][i]["_source"]["system"]["diskio"]["iostat"]["read"]["request"][
-                                  "merges_per_sec"])
-            readtime_series.append(res_dict["diskio"]["hits"][i]['_source']['system']["diskio"]["read"]["time"])
-            dsw_series.append(res_dict["diskio"]["hits"][i]['_source']['system']["diskio"]["write"]["bytes"] / 512.0)
-            dswrites_series.append(res_dict["diskio"]["hits"][i]['_source']['system']["diskio"]["write"]["count"])
-            dwm_series.append(
-                res_dict["diskio"]["hits"][i]["_source"]["system"]["diskio"]["iostat"]["write"]["request"][
-                    "merges_per_sec"])
-            writetime_series.append(res_dict["diskio"]["hits"][i]['_source']['system']["diskio"]["write"]["time"])
-        nbr_series = []
-        nbs_series = []
-        for i in range(module_total["network"]):
-            nbr_series.append(res_dict["network"]["hits"][i]['_source']['system']["network"]["out"]["bytes"])
-            nbs_series.append(res_dict["network"]["hits"][i]['_source']['system']["network"]["in"]["bytes"])
-        loadavg_series = []
-        for i in range(module_total["process_summary"]):
-            loadavg_series.append(
-                res_dict["process_summary"]["hits"][i]['_source']['system']['process']['summary']['running'])
-        mem_used_bytes_series = []
-        mem_used_pct_series = []
-        for i in range(module_total["memory"]):
-            mem_used_bytes_series.append(
-                res_dict["memory"]["hits"][i]['_source']['system']['memory']['actual']['used']['bytes'])
-            mem_used_pct_series.append(
-                res_dict["memory"]["hits"][i]['_source']['system']['memory']['actual']['used']['pct'])
-        cpu_time_series = [y - x for x, y in zip(cpu_time_series, cpu_time_series[1:])]
-        cpu_usr_series = [y - x for x, y in zip(cpu_usr_series, cpu_usr_series[1:])]
-        cpu_krn_series = [y - x for x, y in zip(cpu_krn_series, cpu_krn_series[1:])]
-        cpu_idle_series = [y - x for x, y in zip(cpu_idle_series, cpu_idle_series[1:])]
-        cpu_io_wait_series = [y - x for x, y in zip(cpu_io_wait_series, cpu_io_wait_series[1:])]
-        cpu_sint_time_series = [y - x for x, y in zip(cpu_io_wait_series, cpu_sint_time_series[1:])]
-        dsr_series = [y - x for x, y in zip(dsr_series, dsr_series[1:])]
-        dsreads_series = [y - x for x, y in zip(dsreads_series, dsreads_series[1:])]
-        readtime_series = [y - x for x, y in zip(readtime_series, readtime_series[1:])]
-        dsw_series = [y - x for x, y in zip(dsw_series, dsw_series[1:])]
-        dswrites_series = [y - x for x, y in zip(dswrites_series, dswrites_series[1:])]
-        writetime_series = [y - x for x, y in zip(writetime_series, writetime_series[1:])]
-        nbr_series = [y - x for x, y in zip(nbr_series, nbr_series[1:])]
-        nbs_series = [y - x for x, y in zip(nbs_series, nbs_series[1:])]
-        dic["cpu_time"]["avg"] = np.mean(cpu_time_series)
-        dic["cpu_time"]["min"] = np.min(cpu_time_series)
-        dic["cpu_time"]["max"] = np.max(cpu_time_series)
-        dic["cpu_time"]["std"] = np.std(cpu_time_series)
-        dic["cpu_time"]["percentile5"] = np.percentile(cpu_time_series, 5)
-        dic["cpu_time"]["percentile95"] = np.percentile(cpu_time_series, 95)
-        dic["cpu_usr"]["avg"] = np.mean(cpu_usr_series)
-        dic["cpu_usr"]["min"] = np.min(cpu_usr_series)
-        dic["cpu_usr"]["max"] = np.max(cpu_usr_series)
-        dic["cpu_usr"]["std"] = np.std(cpu_usr_series)
-        dic["cpu_usr"]["percentile5"] = np.percentile(cpu_usr_series, 5)
-        dic["cpu_usr"]["percentile95"] = np.percentile(cpu_usr_series, 95)
-        dic["cpu_krn"]["avg"] = np.mean(cpu_krn_series)
-        dic["cpu_krn"]["min"] = np.min(cpu_krn_series)
-        dic["cpu_krn"]["max"] = np.max(cpu_krn_series)
-        dic["cpu_krn"]["std"] = np.std(cpu_krn_series)
-        dic["cpu_krn"]["percentile5"] = np.percentile(cpu_krn_series, 5)
-        dic["cpu_krn"]["percentile95"] = np.percentile(cpu_krn_series, 95)
-        dic["cpu_idle"]["avg"] = np.mean(cpu_idle_series)
-        dic["cpu_idle"]["min"] = np.min(cpu_idle_series)
-        dic["cpu_idle"]["max"] = np.max(cpu_idle_series)
-        dic["cpu_idle"]["std"] = np.std(cpu_idle_series)
-        dic["cpu_idle"]["percentile5"] = np.percentile(cpu_idle_series, 5)
-        dic["cpu_idle"]["percentile95"] = np.percentile(cpu_idle_series, 95)
-        dic["cpu_io_wait"]["avg"] = np.mean(cpu_io_wait_series)
-        dic["cpu_io_wait"]["min"] = np.min(cpu_io_wait_series)
-        dic["cpu_io_wait"]["max"] = np.max(cpu_io_wait_series)
-        dic["cpu_io_wait"]["std"] = np.std(cpu_io_wait_series)
-        dic["cpu_io_wait"]["percentile5"] = np.percentile(cpu_io_wait_series, 5)
-        dic["cpu_io_wait"]["percentile95"] = np.percentile(cpu_io_wait_series, 95)
-        dic["cpu_sint_time"]["avg"] = np.mean(cpu_sint_time_series)
-        dic["cpu_sint_time"]["min"] = np.min(cpu_sint_time_series)
-        dic["cpu_sint_time"]["max"] = np.max(cpu_sint_time_series)
-        dic["cpu_sint_time"]["std"] = np.std(cpu_sint_time_series)
-        dic["cpu_sint_time"]["percentile5"] = np.percentile(cpu_sint_time_series, 5)
-        dic["cpu_sint_time"]["percentile95"] = np.percentile(cpu_sint_time_series, 95)
-        dic["dsr"]["avg"] = np.mean(dsr_series)
-        dic["dsr"]["min"] = np.min(dsr_series)
-        dic["dsr"]["max"] = np.max(dsr_series)
-        dic["dsr"]["std"] = np.std(dsr_series)
-        dic["dsr"]["percentile5"] = np.percentile(dsr_series, 5)
-        dic["dsr"]["percentile95"] = np.percentile(dsr_series, 95)
-        dic["dsreads"]["avg"] = np.mean(dsreads_series)
-        dic["dsreads"]["min"] = np.min(dsreads_series)
-        dic["dsreads"]["max"] = np.max(dsreads_series)
-        dic["dsreads"]["std"] = np.std(dsreads_series)
-        dic["dsreads"]["percentile5"] = np.percentile(dsreads_series, 5)
-        dic["dsreads"]["percentile95"] = np.percentile(dsreads_series, 95)
-        dic["drm"]["avg"] = np.mean(drm_series)
-        dic["drm"]["min"] = np.min(drm_series)
-        dic["drm"]["max"] = np.max(drm_series)
-        dic["drm"]["std"] = np.std(drm_series)
-        dic["drm"]["percentile5"] = np.percentile(drm_series, 5)
-        dic["drm"]["percentile95"] = np.percentile(drm_series, 95)
-        dic["readtime"]["avg"] = np.mean(readtime_series)
-        dic["readtime"]["min"] = np.min(readtime_series)
-        dic["readtime"]["max"] = np.max(readtime_series)
-        dic["readtime"]["std"] = np.std(readtime_series)
-        dic["readtime"]["percentile5"] = np.percentile(readtime_series, 5)
-        dic["readtime"]["percentile95"] = np.percentile(readtime_series, 95)
-        dic["dsw"]["avg"] = np.mean(dsw_series)
-        dic["dsw"]["min"] = np.min(dsw_series)
-        dic["dsw"]["max"] = np.max(dsw_series)
-        dic["dsw"]["std"] = np.std(dsw_series)
-        dic["dsw"]["percentile5"] = np.percentile(dsw_series, 5)
-        dic["dsw"]["percentile95"] = np.percentile(dsw_series, 95)
-        dic["dswrites"]["avg"] = np.mean(dswrites_series)
-        dic["dswrites"]["min"] = np.min(dswrites_series)
-        dic["dswrites"]["max"] = np.max(dswrites_series)
-        dic["dswrites"]["std"] = np.std(dswrites_series)
-        dic["dswrites"]["percentile5"] = np.percentile(dswrites_series, 5)
-        dic["dswrites"]["percentile95"] = np.percentile(dswrites_series, 95)
-        dic["dwm"]["avg"] = np.mean(dwm_series)
-        dic["dwm"]["min"] = np.min(dwm_series)
-        dic["dwm"]["max"] = np.max(dwm_series)
-        dic["dwm"]["std"] = np.std(dwm_series)
-        dic["dwm"]["percentile5"] = np.percentile(dwm_series, 5)
-        dic["dwm"]["percentile95"] = np.percentile(dwm_series, 95)
-        dic["writetime"]["avg"] = np.mean(writetime_series)
-        dic["writetime"]["min"] = np.min(writetime_series)
-        dic["writetime"]["max"] = np.max(writetime_series)
-        dic["writetime"]["std"] = np.std(writetime_series)
-        dic["writetime"]["percentile5"] = np.percentile(writetime_series, 5)
-        dic["writetime"]["percentile95"] = np.percentile(writetime_series, 95)
-        dic["nbr"]["avg"] = np.mean(nbr_series)
-        dic["nbr"]["min"] = np.min(nbr_series)
-        dic["nbr"]["max"] = np.max(nbr_series)
-        dic["nbr"]["std"] = np.std(nbr_series)
-        dic["nbr"]["percentile5"] = np.percentile(nbr_series, 5)
-        dic["nbr"]["percentile95"] = np.percentile(nbr_series, 95)
-        dic["nbs"]["avg"] = np.mean(nbs_series)
-        dic["nbs"]["min"] = np.min(nbs_series)
-        dic["nbs"]["max"] = np.max(nbs_series)
-        dic["nbs"]["std"] = np.std(nbs_series)
-        dic["nbs"]["percentile5"] = np.percentile(nbs_series, 5)
-        dic["nbs"]["percentile95"] = np.percentile(nbs_series, 95)
-        dic["loadavg"]["avg"] = np.mean(loadavg_series)
-        dic["loadavg"]["min"] = np.min(loadavg_series)
-        dic["loadavg"]["max"] = np.max(loadavg_series)
-        dic["loadavg"]["std"] = np.std(loadavg_series)
-        dic["loadavg"]["percentile5"] = np.percentile(loadavg_series, 5)
-        dic["loadavg"]["percentile95"] = np.percentile(loadavg_series, 95)
-        dic["mem_used_bytes"]["avg"] = np.mean(mem_used_bytes_series)
-        dic["mem_used_bytes"]["min"] = np.min(mem_used_bytes_series)
-        dic["mem_used_bytes"]["max"] = np.max(mem_used_bytes_series)
-        dic["mem_used_bytes"]["std"] = np.std(mem_used_bytes_series)
-        dic["mem_used_bytes"]["percentile5"] = np.percentile(mem_used_bytes_series, 5)
-        dic["mem_used_bytes"]["percentile95"] = np.percentile(mem_used_bytes_series, 95)
-        dic["mem_used_pct"]["avg"] = np.mean(mem_used_pct_series)
-        dic["mem_used_pct"]["min"] = np.min(mem_used_pct_series)
-        dic["mem_used_pct"]["max"] = np.max(mem_used_pct_series)
-        dic["mem_used_pct"]["std"] = np.std(mem_used_pct_series)
-        dic["mem_used_pct"]["percentile5"] = np.percentile(mem_used_pct_series, 5)
-        dic["mem_used_pct"]["percentile95"] = np.percentile(mem_used_pct_series, 95)
-        return dic
\ No newline at end of file
+        for item in self.system_modules:
+            timestamps, samples = res_dict[item]
+            dic.update(self.MetricsetStatistics(item, samples, timestamps, period))
+        return dic
+
+    def MetricsetFields(self, metricset, specs=METRIC_SPECS):
+        # every source field the metrics of the metricset need, each one once
+        fields = []
+        for spec in specs:
+            if spec.metricset == metricset:
+                for field in spec.fields:
+                    if field not in fields:
+                        fields.append(field)
+        return fields
+
+    def MetricsetArray(self, metricset, hits):
+        # one row per sample, one column per field of MetricsetFields(). A field missing from a document is NaN,
+        # e.g. iostat in the first event after Metricbeat restarts, and is left out of the statistics
+        paths = [field.split(".") for field in self.MetricsetFields(metricset)]
+        return np.array([[get_field(hit["_source"], path, np.nan) for path in paths] for hit in hits],
+                        dtype=float).reshape(-1, len(paths))
+
+    def MetricValues(self, metricset, samples, specs=METRIC_SPECS):
+        # the field columns of samples combined into one column per metric of the metricset by a matrix product
+        fields = self.MetricsetFields(metricset, specs)
+        specs = [spec for spec in specs if spec.metricset == metricset]
+        combine = np.zeros((len(fields), len(specs)))
+        for idx, spec in enumerate(specs):
+            for field in spec.fields:
+                combine[fields.index(field), idx] = 1
+        scale = np.array([spec.scale for spec in specs])
+        counter = np.array([spec.counter for spec in specs], dtype=bool)
+        return specs, np.dot(samples, combine) * scale, counter
+
+    def MetricsetStatistics(self, metricset, samples, timestamps=None, period=None):
+        """All statistics of every metric of the metricset, from its samples array.
+
+        The metric columns are the field columns combined by MetricValues, then counters are
+        turned into rates and every statistic is computed for all columns at once. With timestamps
+        the rates are the increase per second times the period, so late or early samples don't skew
+        them, and intervals over a counter reset or a gap of dropped events are left out. period
+        defaults to self.period.
+        """
+        specs, values, counter = self.MetricValues(metricset, samples)
+        rates = self.CounterRates(values[:, counter], timestamps, period)
+
+        dic = {}
+        for mask, series in [(counter, rates), (~counter, values[:, ~counter])]:
+            names = [spec.name for spec, selected in zip(specs, mask) if selected]
+            for name, stats in zip(names, column_statistics(series)):
+                dic[name] = stats
+        return dic
+
+    def CounterRates(self, counters, timestamps=None, period=None):
+        # increase per period between consecutive samples, NaN where the interval is a reset or a gap
+        period = self.period if period is None else period
+        deltas = np.diff(counters, axis=0)
+        if timestamps is None:
+            return deltas
+        intervals = np.diff(timestamps)
+        valid = (intervals > 0) & (intervals <= self.max_gap * period)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rates = deltas * (period / intervals)[:, np.newaxis]
+        # a counter going backwards was reset, e.g. by a reboot
+        rates[~valid[:, np.newaxis] | (deltas < 0)] = np.nan
+        return rates
+
+    def ContainerQueries(self, hostnames, start_time="now-1m"):
+        # Docker module queries of every host, the container metricset only gives the name and image
+        queries = {}
+        for hostname in hostnames:
+            for item in self.container_modules + ["container"]:
+                fields = ["docker.container.id"]
+                if item == "container":
+                    fields += ["docker.container.name", "docker.container.image"]
+                elif item == "network":
+                    fields += ["docker.network.interface"] + self.MetricsetFields(item, CONTAINER_METRIC_SPECS)
+                else:
+                    fields += self.MetricsetFields(item, CONTAINER_METRIC_SPECS)
+                queries[(hostname, item)] = lambda after, hostname=hostname, item=item, fields=fields: \
+                    self.SystemQuery(hostname, item, start_time, after, module="docker", fields=fields)
+        return queries
+
+    def QueryContainerModules(self, hostnames, start_time="now-1m", duration_in_seconds=0, wait=False):
+        """Docker module samples of every host, {host: {metricset: (timestamps, series, samples)}}.
+
+        series holds the container id of every row, joined with the interface for network rows.
+        A field missing from a document is NaN. {host: {"container": {container id: (name, image)}}}
+        holds what the ids stand for.
+        """
+        if (wait == True):
+            time.sleep(duration_in_seconds)
+        queries = self.ContainerQueries(hostnames, start_time)
+        pages = {}
+        for key in queries:
+            pages[key] = {} if key[1] == "container" else []
+        for key, hits in self.SearchPages(queries):
+            if hits is None or pages[key] is None:
+                pages[key] = None
+            elif key[1] == "container":
+                for hit in hits:
+                    container = hit["_source"]["docker"]["container"]
+                    pages[key][container["id"]] = (container.get("name"), container.get("image"))
+            else:
+                pages[key].append(self.ContainerArrays(key[1], hits))
+
+        res = {}
+        for hostname in hostnames:
+            res[hostname] = {}
+        for (hostname, item), page in pages.items():
+            if page is None or item == "container":
+                res[hostname][item] = page
+            else:
+                res[hostname][item] = tuple(np.concatenate(arrays) for arrays in zip(*page)) if page else None
+        return res
+
+    def ContainerArrays(self, metricset, hits):
+        # timestamps, series and samples of a page of Docker module hits
+        paths = [field.split(".") for field in self.MetricsetFields(metricset, CONTAINER_METRIC_SPECS)]
+        samples = np.array([[get_field(hit["_source"], path, np.nan) for path in paths] for hit in hits],
+                           dtype=float).reshape(-1, len(paths))
+        series = np.array([get_field(hit["_source"], ["docker", "container", "id"], "") + "/" +
+                           get_field(hit["_source"], ["docker", "network", "interface"], "") for hit in hits],
+                          dtype=object)
+        return hit_timestamps(hits), series, samples
+
+    def GetContainerStatistics(self, start_time="now-1m", duration_in_seconds=0, wait=False):
+        return self.GetHostsContainerStatistics([self.hostname], start_time, duration_in_seconds, wait)[self.hostname]
+
+    def GetHostsContainerStatistics(self, hostnames, start_time="now-1m", duration_in_seconds=0, wait=False):
+        """Statistics of every container of every host, {host: {container id: stats}}.
+
+        stats holds the container "name" and "image" next to the metrics of CONTAINER_METRIC_SPECS,
+        each with the same six statistics as GetStatistics.
+        """
+        try:
+            res = self.QueryContainerModules(hostnames, start_time, duration_in_seconds, wait)
+        except:
+            return {hostname: {} for hostname in hostnames}
+        return {hostname: self.ComputeContainerStatistics(res[hostname]) for hostname in hostnames}
+
+    def ComputeContainerStatistics(self, res_dict):
+        containers = {}
+        for container_id, (name, image) in (res_dict.get("container") or {}).items():
+            containers[container_id] = {"name": name, "image": image}
+        for item in self.container_modules:
+            if res_dict.get(item) is None:
+                continue
+            timestamps, series, samples = res_dict[item]
+            for container_id, stats in self.ContainerMetricsetStatistics(item, samples, timestamps, series).items():
+                containers.setdefault(container_id, {"name": None, "image": None}).update(stats)
+        return containers
+
+    def ContainerMetricsetStatistics(self, metricset, samples, timestamps, series):
+        """Statistics of every metric of the metricset for every container.
+
+        Rows are sorted by series and time, so the counters of all series are turned into rates by
+        one CounterRates call, masking the intervals between two series. Rates and gauges of the
+        series of one container are summed up per timestamp before the statistics are computed.
+        """
+        if samples.shape[0] == 0:
+            return {}
+        order = np.lexsort((timestamps, series))
+        samples, timestamps, series = samples[order], timestamps[order], series[order]
+        specs, values, counter = self.MetricValues(metricset, samples, CONTAINER_METRIC_SPECS)
+
+        rates = self.CounterRates(values[:, counter], timestamps)
+        rates[series[1:] != series[:-1]] = np.nan
+        container_ids, codes = np.unique([item.split("/")[0] for item in series], return_inverse=True)
+
+        res = {}
+        for mask, columns, rows in [(counter, rates, slice(1, None)), (~counter, values[:, ~counter], slice(None))]:
+            names = [spec.name for spec, selected in zip(specs, mask) if selected]
+            if not names:
+                continue
+            # one row per container and timestamp
+            groups, inverse = np.unique(np.column_stack([codes[rows], timestamps[rows]]), axis=0,
+                                        return_inverse=True)
+            summed = np.zeros((groups.shape[0], columns.shape[1]))
+            np.add.at(summed, inverse.reshape(-1), columns)
+            for code, container_id in enumerate(container_ids):
+                stats = column_statistics(summed[groups[:, 0] == code])
+                res.setdefault(container_id, {}).update(zip(names, stats))
+        return res
+
+
+class MetricsCache(object):
+    """The last `window_in_seconds` of samples of a set of hosts, kept between statistics calls.
+
+    Refresh() fetches only the documents newer than the last one seen per host and metricset and
+    evicts the samples that fell out of the window, so consecutive calls cost a page per metricset
+    instead of the whole window. Statistics are computed from the cached samples.
+    """
+    def __init__(self, beat, window_in_seconds=60):
+        self.beat = beat
+        self.window_in_seconds = window_in_seconds
+        # (hostname, metricset) -> (timestamps, samples, last sort values)
+        self.samples = {}
+
+    def Refresh(self, hostnames):
+        keys = [(hostname, item) for hostname in hostnames for item in self.beat.system_modules]
+        search_after = {key: self.samples[key][2] for key in keys if key in self.samples}
+        try:
+            fetched = self.beat.FetchSamples(keys, "now-{0}s".format(int(self.window_in_seconds)), search_after)
+        except:
+            # Elasticsearch is unreachable, keep serving what is cached
+            fetched = {}
+
+        oldest = time.time() - self.window_in_seconds
+        for key in keys:
+            timestamps, samples, last_sort = self.samples.get(key, (np.zeros(0), None, None))
+            if fetched.get(key) is not None:
+                new_timestamps, new_samples, new_sort = fetched[key]
+                if samples is not None:
+                    new_timestamps = np.concatenate([timestamps, new_timestamps])
+                    new_samples = np.concatenate([samples, new_samples])
+                timestamps, samples, last_sort = new_timestamps, new_samples, new_sort
+            if samples is None:
+                continue
+            keep = timestamps >= oldest
+            self.samples[key] = (timestamps[keep], samples[keep], last_sort)
+
+    def GetHostsStatistics(self, hostnames, refresh=True, window_in_seconds=None):
+        # window_in_seconds narrows the statistics to the most recent part of the cached window
+        if refresh:
+            self.Refresh(hostnames)
+        oldest = time.time() - (self.window_in_seconds if window_in_seconds is None else window_in_seconds)
+        res = {}
+        for hostname in hostnames:
+            res_dict = {}
+            for item in self.beat.system_modules:
+                if (hostname, item) in self.samples:
+                    timestamps, samples, last_sort = self.samples[(hostname, item)]
+                    keep = timestamps >= oldest
+                    res_dict[item] = (timestamps[keep], samples[keep])
+            res[hostname] = self.beat.ComputeStatistics(res_dict, self.beat.HostPeriod(hostname))
+        return res
+
+    def GetStatistics(self, hostname, refresh=True, window_in_seconds=None):
+        return self.GetHostsStatistics([hostname], refresh, window_in_seconds)[hostname]
+
+
+def hit_timestamps(hits):
+    # the first sort value is @timestamp in epoch milliseconds
+    return np.array([hit["sort"][0] / 1000.0 for hit in hits], dtype=float)
+
+
+def get_field(source, path, default=None):
+    # without a default a missing field raises KeyError
+    for key in path:
+        if default is not None and (not isinstance(source, dict) or key not in source):
+            return default
+        source = source[key]
+    return source
+
+
+def column_statistics(series):
+    # the six statistics of every column of series ignoring NaNs, columns without samples get zeros
+    stats = [{"avg": 0, "min": 0, "max": 0, "std": 0, "percentile5": 0, "percentile95": 0}
+             for i in range(series.shape[1])]
+    columns = np.flatnonzero(np.any(~np.isnan(series), axis=0))
+    if columns.shape[0] == 0:
+        return stats
+    series = series[:, columns]
+    avg = np.nanmean(series, axis=0)
+    low = np.nanmin(series, axis=0)
+    high = np.nanmax(series, axis=0)
+    std = np.nanstd(series, axis=0)
+    percentile5, percentile95 = np.nanpercentile(series, [5, 95], axis=0)
+    for idx, column in enumerate(columns):
+        stats[column] = {"avg": avg[idx], "min": low[idx], "max": high[idx], "std": std[idx],
+                         "percentile5": percentile5[idx], "percentile95": percentile95[idx]}
+    return stats
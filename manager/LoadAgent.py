@@ -0,0 +1,212 @@
+"""
+Load generation agent, run it on other machines so tests are not limited by the manager's NIC and CPU.
+
+    python LoadAgent.py 8900
+
+A test is started with POST /test and a JSON spec, for example
+{"url": "http://10.2.6.171/fileio", "mode": "RPS", "rps": 50, "timeout": "1m", "warmup": "10s"}.
+The response streams one JSON line per report_interval with the LoadTester summary of the test,
+the last one has "final": true. DELETE /test/<test_id> stops a running test.
+"""
+import http.server
+import json
+import multiprocessing
+import socket
+import socketserver
+import sys
+import threading
+import uuid
+
+import requests
+import urllib3
+
+import ArrivalProcess
+import LoadTester
+import UserSession
+
+
+class LoadAgentServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address):
+        http.server.HTTPServer.__init__(self, server_address, LoadAgentHandler)
+        self.tests = {}
+
+
+class LoadAgentHandler(http.server.BaseHTTPRequestHandler):
+    def send_json(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path == '/':
+            self.send_json(200, {'tests': list(self.server.tests.keys())})
+        else:
+            self.send_json(404, {'msg': 'Not found'})
+
+    def do_DELETE(self):
+        test_id = self.path.rstrip('/').split('/')[-1]
+        if not self.path.startswith('/test/') or test_id not in self.server.tests:
+            self.send_json(404, {'msg': 'Test not found'})
+            return
+        self.server.tests[test_id].stop_test()
+        self.send_json(200, {'test_id': test_id, 'msg': 'Stopping'})
+
+    def do_POST(self):
+        if self.path != '/test':
+            self.send_json(404, {'msg': 'Not found'})
+            return
+        try:
+            spec = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+            tester = LoadTester.LoadTester(spec['url'], timeout=spec.get('timeout', '10s'),
+                                           warmup=spec.get('warmup', '1s'),
+                                           num_of_clients=int(spec.get('num_of_clients', 10)),
+                                           **spec.get('tester_kwargs', {}))
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'msg': 'Invalid test spec: ' + str(e)})
+            return
+
+        test_id = uuid.uuid4().hex
+        self.server.tests[test_id] = tester
+
+        # no Content-Length, the stream ends when the connection is closed after the final line
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+
+        if spec.get('mode', 'RPS') == 'RPS':
+            arrival = None
+            if 'arrival' in spec:
+                arrival = ArrivalProcess.arrival_from_spec(spec['arrival'])
+            tester.perform_test_rps_async(rps=spec.get('rps', 0.5), arrival=arrival)
+        else:
+            tester.perform_test_async()
+
+        disconnected = threading.Event()
+
+        def report(final, summary):
+            if disconnected.is_set():
+                return
+            try:
+                line = json.dumps({'test_id': test_id, 'final': final, 'summary': summary}) + '\n'
+                self.wfile.write(line.encode('utf-8'))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # nobody is listening anymore, stop generating load
+                disconnected.set()
+
+        # first line right away, so the caller learns the test_id and can stop it
+        report(False, tester.summary())
+        try:
+            LoadTester.report_until_finished(tester, spec.get('report_interval', 5), report, disconnected.is_set)
+        finally:
+            del self.server.tests[test_id]
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_agent(port, host='0.0.0.0'):
+    server = LoadAgentServer((host, port))
+    server.serve_forever()
+
+
+def start_local_agents(count, base_port=8900):
+    # agents as local processes, mainly for testing the remote path on one machine
+    agents = []
+    processes = []
+    for i in range(count):
+        process = multiprocessing.Process(target=run_agent, args=(base_port + i, '127.0.0.1'), daemon=True)
+        process.start()
+        processes.append(process)
+        agents.append('http://127.0.0.1:{0}'.format(base_port + i))
+    return agents, processes
+
+
+class RemoteLoadTester(LoadTester.MergedLoadTester):
+    """Fans a test out to several load agents and merges the summaries they stream back."""
+    def __init__(self, url, *args, **kwargs):
+        agents = kwargs.pop('agents')
+        super(RemoteLoadTester, self).__init__(url, len(agents), **kwargs)
+        self.agents = agents
+        self.test_ids = {}
+        self.streams = []
+
+    def start_shards(self, shard_loads, rps_mode, shard_arrivals=None):
+        self.shard_summaries = {}
+        self.shards_done = set()
+        self.test_ids = {}
+        self.streams = []
+
+        tester_kwargs = dict(self.tester_kwargs)
+        timeout = tester_kwargs.pop('timeout', '10s')
+        warmup = tester_kwargs.pop('warmup', '1s')
+        if isinstance(tester_kwargs.get('session'), UserSession.SessionModel):
+            tester_kwargs['session'] = tester_kwargs['session'].spec()
+        for shard_id, shard_load in enumerate(shard_loads):
+            spec = {
+                'url': self.url,
+                'mode': 'RPS' if rps_mode else 'Interactive',
+                'timeout': timeout,
+                'warmup': warmup,
+                'report_interval': self.report_interval,
+                'tester_kwargs': tester_kwargs,
+            }
+            if rps_mode:
+                spec['rps'] = shard_load
+                if shard_arrivals is not None:
+                    spec['arrival'] = shard_arrivals[shard_id].spec()
+            else:
+                spec['num_of_clients'] = shard_load
+                # users go on from the agents before, the endpoint mix and sessions are assigned over all of them
+                spec['tester_kwargs'] = dict(tester_kwargs, first_user_id=int(sum(shard_loads[:shard_id])))
+
+            stream = threading.Thread(target=self.stream_agent, args=(shard_id, self.agents[shard_id], spec),
+                                      daemon=True)
+            stream.start()
+            self.streams.append(stream)
+
+    def stream_agent(self, shard_id, agent, spec):
+        try:
+            # agents report every report_interval, a few missed reports means the agent or the network is gone
+            read_timeout = max(3 * self.report_interval, 10)
+            resp = requests.post(agent + '/test', json=spec, stream=True, timeout=(10, read_timeout))
+            if resp.status_code != 200:
+                print(agent, resp.status_code, resp.content)
+                return
+            # line by line, iter_lines() would hold back partial chunks
+            for line in iter(resp.raw.readline, b''):
+                line = line.strip()
+                if not line:
+                    continue
+                message = json.loads(line.decode('utf-8'))
+                self.test_ids[shard_id] = message['test_id']
+                self.shard_summaries[shard_id] = message['summary']
+                if message['final']:
+                    break
+        except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError, socket.timeout) as e:
+            # the shard is done with the last summary it sent
+            print('Load agent', agent, 'failed:', e)
+        finally:
+            self.shards_done.add(shard_id)
+
+    def stop_test(self):
+        for shard_id, test_id in list(self.test_ids.items()):
+            try:
+                requests.delete(self.agents[shard_id] + '/test/' + test_id, timeout=10)
+            except requests.exceptions.RequestException as e:
+                print('Load agent', self.agents[shard_id], 'failed:', e)
+
+    def wait_for_test_results(self, warmup=False):
+        for stream in self.streams:
+            stream.join()
+        self.prepare_results()
+
+
+if __name__ == '__main__':
+    run_agent(int(sys.argv[1]) if len(sys.argv) > 1 else 8900)
@@ -1,4 +1,13 @@
+import abc
+import asyncio
+import bisect
+import collections
 import http.client
+import itertools
+import math
+import multiprocessing
+import queue
+import random
 import socket
 import threading
 import time
@@ -6,6 +15,10 @@ import time
 from urllib.parse import urlparse
 import numpy as np
 
+import ArrivalProcess
+import ConnectionPool
+import UserSession
+
 
 class TimerClass:
     def __init__(self):
@@ -24,8 +37,424 @@ class TimerClass:
         return elapsed
 
 
+class LatencyHistogram:
+    """Fixed-memory latency store with log-sized buckets.
+
+    Bucket i holds values in (lowest_ms * gamma^(i-1), lowest_ms * gamma^i], so every reported
+    percentile is within `precision` of the recorded value. Histograms with the same settings
+    can be merged by adding their counts.
+    """
+    def __init__(self, lowest_ms=0.001, highest_ms=3600000.0, precision=0.01):
+        self.lowest_ms = lowest_ms
+        self.highest_ms = highest_ms
+        self.precision = precision
+        self.log_gamma = math.log(1 + precision)
+        self.bucket_count = int(math.ceil(math.log(highest_ms / lowest_ms) / self.log_gamma)) + 1
+        self.counts = np.zeros(self.bucket_count, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def bucket_index(self, value):
+        if value <= self.lowest_ms:
+            return 0
+        return min(int(math.ceil(math.log(value / self.lowest_ms) / self.log_gamma)), self.bucket_count - 1)
+
+    def bucket_value(self, idx):
+        # geometric middle of the bucket, clamped to what was actually recorded
+        value = self.lowest_ms * math.exp((idx - 0.5) * self.log_gamma)
+        return min(max(value, self.min), self.max)
+
+    def record(self, value):
+        idx = self.bucket_index(value)
+        with self.lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.total += value
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def merge(self, other):
+        if self.bucket_count != other.bucket_count or self.lowest_ms != other.lowest_ms:
+            raise Exception('Cannot merge histograms with different bucket settings!')
+        with self.lock:
+            self.counts += other.counts
+            self.count += other.count
+            self.total += other.total
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        return self
+
+    def reset(self):
+        with self.lock:
+            self.counts[:] = 0
+            self.count = 0
+            self.total = 0.0
+            self.min = math.inf
+            self.max = 0.0
+
+    def mean(self):
+        if self.count == 0:
+            return 0
+        return self.total / self.count
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0
+        rank = max(int(math.ceil(self.count * p / 100.0)), 1)
+        idx = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return self.bucket_value(idx)
+
+    def get_min(self):
+        if self.count == 0:
+            return 0
+        return self.min
+
+    def get_max(self):
+        return self.max
+
+    def copy(self):
+        histogram = LatencyHistogram(lowest_ms=self.lowest_ms, highest_ms=self.highest_ms, precision=self.precision)
+        with self.lock:
+            histogram.counts = self.counts.copy()
+            histogram.count = self.count
+            histogram.total = self.total
+            histogram.min = self.min
+            histogram.max = self.max
+        return histogram
+
+    def difference(self, earlier):
+        # what was recorded after `earlier`, a copy() of this histogram, was taken; min and max
+        # are only known to bucket precision
+        histogram = self.copy()
+        histogram.counts -= earlier.counts
+        histogram.count -= earlier.count
+        histogram.total -= earlier.total
+        idx = np.nonzero(histogram.counts)[0]
+        if len(idx) > 0:
+            histogram.min = max(self.lowest_ms * math.exp((idx[0] - 1) * self.log_gamma), self.min)
+            histogram.max = min(self.lowest_ms * math.exp(idx[-1] * self.log_gamma), self.max)
+        else:
+            histogram.min = math.inf
+            histogram.max = 0.0
+        return histogram
+
+    def to_dict(self):
+        # sparse form, small enough to ship between processes every few seconds
+        with self.lock:
+            idx = np.nonzero(self.counts)[0]
+            return {
+                'lowest_ms': self.lowest_ms,
+                'highest_ms': self.highest_ms,
+                'precision': self.precision,
+                'index': idx.tolist(),
+                'counts': self.counts[idx].tolist(),
+                'count': self.count,
+                'total': self.total,
+                'min': self.min if self.count > 0 else None,
+                'max': self.max,
+            }
+
+    @staticmethod
+    def from_dict(d):
+        histogram = LatencyHistogram(lowest_ms=d['lowest_ms'], highest_ms=d['highest_ms'], precision=d['precision'])
+        histogram.counts[d['index']] = d['counts']
+        histogram.count = d['count']
+        histogram.total = d['total']
+        if d['min'] is not None:
+            histogram.min = d['min']
+        histogram.max = d['max']
+        return histogram
+
+
+class WindowedSeries:
+    """Per-interval buckets of completed/failed requests, bytes and latency.
+
+    Windows are closed as time moves past them (by a recorded event or by advance()), and every
+    closed window is handed to `on_window` if one is given. Only the last `max_windows` are kept.
+    """
+    def __init__(self, interval=1.0, max_windows=3600, on_window=None):
+        self.interval = interval
+        self.max_windows = max_windows
+        self.on_window = on_window
+        self.start_time = None
+        self.current = None
+        self.windows = collections.deque(maxlen=max_windows)
+        self.lock = threading.Lock()
+
+    def new_window(self, idx):
+        return {
+            'index': idx,
+            'time': idx * self.interval,
+            'completed': 0,
+            'failed': 0,
+            'total_bytes': 0,
+            # coarser buckets than the run histogram, one of these exists per window
+            'histogram': LatencyHistogram(precision=0.05),
+        }
+
+    def start(self, start_time=None):
+        with self.lock:
+            self.start_time = time.time() if start_time is None else start_time
+            self.current = self.new_window(0)
+            self.windows.clear()
+
+    def advance_locked(self, now):
+        closed = []
+        idx = max(int((now - self.start_time) / self.interval), 0)
+        while self.current['index'] < idx:
+            closed.append(self.current)
+            self.windows.append(self.current)
+            self.current = self.new_window(self.current['index'] + 1)
+        return closed
+
+    def emit(self, closed):
+        if self.on_window is not None:
+            for window in closed:
+                self.on_window(window_to_dict(window, self.interval))
+
+    def advance(self, now=None):
+        if self.start_time is None:
+            return
+        with self.lock:
+            closed = self.advance_locked(time.time() if now is None else now)
+        self.emit(closed)
+
+    def record(self, now, elapsed, body_len):
+        if self.start_time is None:
+            return
+        with self.lock:
+            closed = self.advance_locked(now)
+            self.current['completed'] += 1
+            self.current['total_bytes'] += body_len
+            self.current['histogram'].record(elapsed)
+        self.emit(closed)
+
+    def record_fail(self, now):
+        if self.start_time is None:
+            return
+        with self.lock:
+            closed = self.advance_locked(now)
+            self.current['failed'] += 1
+        self.emit(closed)
+
+    def time_series(self, include_histogram=False):
+        # the window still being filled is included as the last entry
+        with self.lock:
+            windows = list(self.windows)
+            if self.current is not None:
+                windows.append(self.current)
+        return [window_to_dict(window, self.interval, include_histogram) for window in windows]
+
+
+def window_to_dict(window, interval, include_histogram=True):
+    histogram = window['histogram']
+    ret = {
+        'time': window['time'],
+        'completed': window['completed'],
+        'failed': window['failed'],
+        'total_bytes': window['total_bytes'],
+        'rps': window['completed'] / interval,
+        'avg_ms': histogram.mean(),
+        'p50_ms': histogram.percentile(50),
+        'p90_ms': histogram.percentile(90),
+        'p99_ms': histogram.percentile(99),
+        'max_ms': histogram.get_max(),
+    }
+    if include_histogram:
+        ret['histogram'] = histogram
+    return ret
+
+
+# statuses recorded for requests without a usable HTTP status
+STATUS_NO_RESPONSE = 0
+STATUS_MARKER_MISSING = 1
+
+
+class ResultBuffer:
+    """Growable typed array of per-request records, appended to by one thread at a time.
+
+    A record takes 24 bytes: completion time, latency, latency from the intended send time, body
+    bytes, status and endpoint. Status is STATUS_NO_RESPONSE for requests that failed before a
+    response arrived and STATUS_MARKER_MISSING for a 200 without the tester's status_marker.
+    Without keep_records only the per-endpoint counters are kept, in constant memory.
+    """
+    dtype = np.dtype([('time', 'f8'), ('latency_ms', 'f4'), ('intended_ms', 'f4'), ('bytes', 'u4'),
+                      ('status', 'u2'), ('endpoint', 'u2')])
+
+    def __init__(self, capacity=1024, endpoints=1, keep_records=True):
+        self.keep_records = keep_records
+        self.data = np.empty(capacity if keep_records else 0, dtype=self.dtype)
+        self.size = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_bytes = 0
+        self.endpoint_completed = [0] * endpoints
+        self.endpoint_failed = [0] * endpoints
+        self.endpoint_bytes = [0] * endpoints
+
+    def append(self, now, elapsed, intended_elapsed, body_len, status, endpoint=0):
+        if self.keep_records:
+            if self.size == len(self.data):
+                data = np.empty(len(self.data) * 2, dtype=self.dtype)
+                data[:self.size] = self.data[:self.size]
+                self.data = data
+            self.data[self.size] = (now, elapsed, intended_elapsed, body_len, status, endpoint)
+            self.size += 1
+        if status == 200:
+            self.completed += 1
+            self.total_bytes += body_len
+            self.endpoint_completed[endpoint] += 1
+            self.endpoint_bytes[endpoint] += body_len
+        else:
+            self.failed += 1
+            self.endpoint_failed[endpoint] += 1
+
+    def view(self):
+        # size is read before data, rows below it are never rewritten so the view is consistent
+        size = self.size
+        return self.data[:size]
+
+
+class ResultRecorder:
+    def __init__(self, interval=1.0, max_windows=3600, on_window=None, endpoints=1, keep_records=False):
+        self.histogram = LatencyHistogram()
+        # latency measured from the scheduled send time, includes any queueing in the generator
+        self.intended_histogram = LatencyHistogram()
+        # per-endpoint histograms of a URL mix, a single endpoint just uses the ones above
+        self.endpoints = endpoints
+        if endpoints == 1:
+            self.endpoint_histograms = [self.histogram]
+            self.endpoint_intended_histograms = [self.intended_histogram]
+        else:
+            self.endpoint_histograms = [LatencyHistogram() for i in range(endpoints)]
+            self.endpoint_intended_histograms = [LatencyHistogram() for i in range(endpoints)]
+        self.series = WindowedSeries(interval, max_windows, on_window)
+        # every thread appends to a buffer of its own, so recording takes no lock. Per-request records
+        # grow with the test, they are only kept when asked for
+        self.keep_records = keep_records
+        self.buffers = []
+        self.free_buffers = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def buffer(self):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            with self.lock:
+                if self.free_buffers:
+                    buffer = self.free_buffers.pop()
+                else:
+                    buffer = ResultBuffer(endpoints=self.endpoints, keep_records=self.keep_records)
+                    self.buffers.append(buffer)
+            self.local.buffer = buffer
+        return buffer
+
+    def release_buffer(self):
+        # a finished thread hands its buffer on, so short-lived client threads don't leave one each behind
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is not None:
+            self.local.buffer = None
+            with self.lock:
+                self.free_buffers.append(buffer)
+
+    def record(self, elapsed, body_len, intended_elapsed=None, endpoint=0):
+        if intended_elapsed is None:
+            intended_elapsed = elapsed
+        now = time.time()
+        self.buffer().append(now, elapsed, intended_elapsed, body_len, 200, endpoint)
+        self.histogram.record(elapsed)
+        self.intended_histogram.record(intended_elapsed)
+        if self.endpoints > 1:
+            self.endpoint_histograms[endpoint].record(elapsed)
+            self.endpoint_intended_histograms[endpoint].record(intended_elapsed)
+        self.series.record(now, elapsed, body_len)
+
+    def record_fail(self, status=0, endpoint=0):
+        now = time.time()
+        self.buffer().append(now, 0, 0, 0, status, endpoint)
+        self.series.record_fail(now)
+
+    def views(self):
+        # the filled part of every buffer, without copying
+        with self.lock:
+            buffers = list(self.buffers)
+        return [buffer.view() for buffer in buffers]
+
+    def records(self):
+        # all records in one array ordered by completion time, this one copies
+        if not self.keep_records:
+            raise Exception('Per-request records are only kept with keep_records=True!')
+        records = np.concatenate(self.views()) if self.buffers else np.empty(0, dtype=ResultBuffer.dtype)
+        return records[np.argsort(records['time'], kind='stable')]
+
+    def completed_count(self):
+        return sum(buffer.completed for buffer in list(self.buffers))
+
+    def failed_count(self):
+        return sum(buffer.failed for buffer in list(self.buffers))
+
+    def total_bytes(self):
+        return sum(buffer.total_bytes for buffer in list(self.buffers))
+
+    def endpoint_totals(self):
+        # completed, failed and total bytes per endpoint, summed over the buffers' counters
+        completed = np.zeros(self.endpoints, dtype=np.int64)
+        failed = np.zeros(self.endpoints, dtype=np.int64)
+        total_bytes = np.zeros(self.endpoints)
+        for buffer in list(self.buffers):
+            completed += buffer.endpoint_completed
+            failed += buffer.endpoint_failed
+            total_bytes += buffer.endpoint_bytes
+        return completed, failed, total_bytes
+
+
+class BodyScanner:
+    """Counts the bytes of a response body fed to it chunk by chunk, and looks for `marker` in it.
+
+    Only the last len(marker) - 1 bytes are kept between chunks, so a marker split over two chunks
+    is still found without holding on to the body.
+    """
+    def __init__(self, marker=None):
+        self.marker = marker
+        self.body_len = 0
+        self.found = marker is None
+        self.tail = b''
+
+    def feed(self, data, size=None):
+        size = len(data) if size is None else size
+        self.body_len += size
+        if self.found or size == 0:
+            return
+        if data.find(self.marker, 0, size) >= 0:
+            self.found = True
+            return
+        keep = len(self.marker) - 1
+        if keep > 0:
+            head = bytes(data[:min(keep, size)])
+            if (self.tail + head).find(self.marker) >= 0:
+                self.found = True
+                return
+            self.tail = (self.tail + bytes(data[max(size - keep, 0):size]))[-keep:]
+
+
+def drain_response(response, buffer, scanner):
+    # reads the body into the same buffer over and over instead of building it up
+    view = memoryview(buffer)
+    while True:
+        size = response.readinto(view)
+        if not size:
+            break
+        scanner.feed(buffer, size)
+    return scanner
+
+
 class ClientThread(threading.Thread):
-    def __init__(self, url, latencies, fails, completed, single=False, **kwargs):
+    def __init__(self, url, recorder, single=False, **kwargs):
         super(ClientThread, self).__init__()
         self.url = url
         # if daemon is true this thread will die when the main thread dies
@@ -33,135 +462,373 @@ class ClientThread(threading.Thread):
         self.done = False
         self.timer = TimerClass()
         self.total_timer = TimerClass()
-        self.latencies = latencies
-        self.fails = fails
-        self.completed = completed
+        # warmup clients get no recorder
+        self.recorder = recorder
         self.timeout = kwargs.pop('timeout', 10)
         self.sock_timeout = kwargs.pop('sock_timeout', 10)
         self.warmup = kwargs.pop('warmup', 1)
+        # when the request should have been sent according to the RPS schedule
+        self.intended_time = kwargs.pop('intended_time', None)
         self.o = urlparse(self.url)
         self.host = self.o.netloc
-        self.path = self.o.path
         self.single = single
 
         self.stop_signal = False
 
-        if self.o.scheme == 'https':
-            self.conn = http.client.HTTPSConnection(self.host, timeout=self.sock_timeout)
-        else:
-            self.conn = http.client.HTTPConnection(self.host, timeout=self.sock_timeout)
+        # connections are normally shared with the other clients of the same LoadTester
+        self.pool = kwargs.pop('pool', None)
+        if self.pool is None:
+            self.pool = ConnectionPool.ConnectionPool(sock_timeout=self.sock_timeout)
+        # called with the client once it is done, however run() ends
+        self.on_done = kwargs.pop('on_done', None)
+        # index of the url in the tester's URL mix, pick_endpoint() chooses a new (endpoint, parsed url)
+        # for every request when given
+        self.endpoint = kwargs.pop('endpoint', 0)
+        self.pick_endpoint = kwargs.pop('pick_endpoint', None)
+        # bodies are drained in body_chunk_size pieces into a buffer borrowed from body_buffers,
+        # body_chunk_size=None reads every body whole instead
+        self.body_chunk_size = kwargs.pop('body_chunk_size', 65536)
+        self.body_buffers = kwargs.pop('body_buffers', None)
+        self.status_marker = kwargs.pop('status_marker', None)
+        self.body_buffer = None
+        # pauses between requests from a UserSession.SessionModel, back to back when not given
+        session = kwargs.pop('session', None)
+        self.pauses = None if session is None else session.pauses(kwargs.pop('user_id', 0))
+        self.stop_event = threading.Event()
 
     def stop_client(self):
         self.stop_signal = True
+        self.stop_event.set()
+
+    def think(self, remaining):
+        if self.pauses is not None:
+            self.stop_event.wait(min(next(self.pauses), max(remaining, 0)))
+
+    def record(self, elapsed, body_len):
+        if self.recorder is not None:
+            intended_elapsed = None
+            if self.intended_time is not None:
+                intended_elapsed = max(self.timer.start_time - self.intended_time, 0) * 1000 + elapsed
+            self.recorder.record(elapsed, body_len, intended_elapsed, self.endpoint)
+
+    def record_fail(self, status=0):
+        if self.recorder is not None:
+            self.recorder.record_fail(status, self.endpoint)
+
+    def send_request(self):
+        if self.pick_endpoint is not None:
+            self.endpoint, self.o = self.pick_endpoint()
+        self.timer.tic()
+        conn, r = self.pool.request(self.o, "GET", self.o.path)
+        scanner = BodyScanner(self.status_marker)
+        try:
+            elapsed = self.timer.toc() * 1000
+            if self.body_chunk_size is None:
+                scanner.feed(r.read())
+            else:
+                drain_response(r, self.get_body_buffer(), scanner)
+        except BaseException:
+            conn.close()
+            raise
+        self.pool.release(self.o, conn, r)
+        if r.status == 200 and not scanner.found:
+            return STATUS_MARKER_MISSING, elapsed, scanner.body_len
+        return r.status, elapsed, scanner.body_len
+
+    def get_body_buffer(self):
+        if self.body_buffer is None:
+            try:
+                self.body_buffer = self.body_buffers.pop()
+            except (AttributeError, IndexError):
+                self.body_buffer = bytearray(self.body_chunk_size)
+        return self.body_buffer
 
     def run(self):
-        if self.single:
-            self.timer.tic()
+        try:
+            self.run_requests()
+        finally:
+            if self.recorder is not None:
+                self.recorder.release_buffer()
+            if self.body_buffer is not None and self.body_buffers is not None:
+                self.body_buffers.append(self.body_buffer)
+                self.body_buffer = None
+            self.done = True
+            if self.on_done is not None:
+                self.on_done(self)
 
+    def run_requests(self):
+        if self.single:
             try:
-                self.conn.request("GET", self.path)
-                r = self.conn.getresponse()
-                elapsed = self.timer.toc() * 1000
-                body = r.read()
+                status, elapsed, body_len = self.send_request()
             except TimeoutError:
-                self.fails.append(time.time())
-                self.done = True
+                self.record_fail()
                 return
             except socket.timeout:
-                self.fails.append(time.time())
-                self.done = True
+                self.record_fail()
                 return
             except http.client.RemoteDisconnected:
-                self.fails.append(time.time())
-                self.done = True
+                self.record_fail()
                 return
             except ConnectionResetError:
-                self.done = True
                 return
 
-            if r.status == 200:
-                self.completed.append(len(body))
-                self.latencies.append(elapsed)
-            elif r.status == 301:
+            if status == 200:
+                self.record(elapsed, body_len)
+            elif status == 301:
                 raise Exception('Got Forward page 301 status!')
             else:
-                self.fails.append(time.time())
-                print(r.status)
-
-            self.done = True
-            return
+                self.record_fail(status)
+                # a missing status marker is counted as failed without a line per request
+                if status != STATUS_MARKER_MISSING:
+                    print(status)
         else:
             self.total_timer.tic()
             while self.total_timer.toc() < self.warmup and not self.stop_signal:
                 try:
-                    self.conn.request("GET", self.path)
-                    r = self.conn.getresponse()
-                    elapsed = self.timer.toc() * 1000
-                    body = r.read()
+                    status, elapsed, body_len = self.send_request()
                 except TimeoutError:
-                    self.fails.append(time.time())
+                    self.record_fail()
                     continue
                 except socket.timeout:
-                    self.fails.append(time.time())
+                    self.record_fail()
                     continue
                 except http.client.RemoteDisconnected:
-                    self.fails.append(time.time())
+                    self.record_fail()
                     continue
                 except ConnectionResetError:
                     continue
                 except http.client.CannotSendRequest:
                     time.sleep(.1)
-                    if self.o.scheme == 'https':
-                        self.conn = http.client.HTTPSConnection(self.host, timeout=self.sock_timeout)
-                    else:
-                        self.conn = http.client.HTTPConnection(self.host, timeout=self.sock_timeout)
                     continue
 
-                if r.status == 200:
-                    continue
-                elif r.status == 301:
+                if status == 200:
+                    pass
+                elif status == 301:
                     raise Exception('Got Forward page 301 status!')
                 else:
-                    print(r.status)
+                    if status != STATUS_MARKER_MISSING:
+                        print(status)
+                self.think(self.warmup - self.total_timer.toc())
 
             self.total_timer.tic()
             if self.timeout > 0:
                 while self.total_timer.toc() < self.timeout and not self.stop_signal:
-                    self.timer.tic()
-
                     try:
-                        self.conn.request("GET", self.path)
-                        r = self.conn.getresponse()
-                        elapsed = self.timer.toc() * 1000
-                        body = r.read()
+                        status, elapsed, body_len = self.send_request()
                     except TimeoutError:
-                        self.fails.append(time.time())
+                        self.record_fail()
                         continue
                     except socket.timeout:
-                        self.fails.append(time.time())
+                        self.record_fail()
                         continue
                     except http.client.RemoteDisconnected:
-                        self.fails.append(time.time())
+                        self.record_fail()
                         continue
                     except ConnectionResetError:
                         continue
                     except http.client.CannotSendRequest:
                         time.sleep(.1)
-                        if self.o.scheme == 'https':
-                            self.conn = http.client.HTTPSConnection(self.host, timeout=self.sock_timeout)
-                        else:
-                            self.conn = http.client.HTTPConnection(self.host, timeout=self.sock_timeout)
                         continue
 
-                    if r.status == 200:
-                        self.completed.append(len(body))
-                        self.latencies.append(elapsed)
-                    elif r.status == 301:
+                    if status == 200:
+                        self.record(elapsed, body_len)
+                    elif status == 301:
                         raise Exception('Got Forward page 301 status!')
                     else:
-                        self.fails.append(time.time())
-                        print(r.status)
-            self.done = True
+                        self.record_fail(status)
+                        if status != STATUS_MARKER_MISSING:
+                            print(status)
+                    self.think(self.timeout - self.total_timer.toc())
+
+
+async def read_body(reader, length, scanner, chunk_size):
+    # length None reads up to EOF
+    if chunk_size is None:
+        if length is None:
+            scanner.feed(await reader.read())
+        else:
+            scanner.feed(await reader.readexactly(length))
+        return
+    while length is None or length > 0:
+        data = await reader.read(chunk_size if length is None else min(chunk_size, length))
+        if not data:
+            if length is None:
+                return
+            raise asyncio.IncompleteReadError(b'', length)
+        scanner.feed(data)
+        if length is not None:
+            length -= len(data)
+
+
+async def read_http_response(reader, scanner=None, chunk_size=65536, timer=None):
+    # the body is only passed through scanner, which counts it and looks for its marker. The latency is
+    # taken from timer once the headers are in, as http.client's getresponse() does for ClientThread
+    if scanner is None:
+        scanner = BodyScanner()
+    status_line = await reader.readline()
+    if not status_line:
+        raise http.client.RemoteDisconnected('Remote end closed connection without response')
+    status = int(status_line.split()[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    elapsed = None if timer is None else timer.toc() * 1000
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            chunk_len = int((await reader.readline()).split(b';')[0], 16)
+            if chunk_len == 0:
+                await reader.readline()
+                break
+            await read_body(reader, chunk_len, scanner, chunk_size)
+            await reader.readline()
+    elif 'content-length' in headers:
+        await read_body(reader, int(headers['content-length']), scanner, chunk_size)
+    else:
+        await read_body(reader, None, scanner, chunk_size)
+
+    return status, scanner.body_len, headers, elapsed
+
+
+async def async_http_get(o, sock_timeout=10, pool=None, status_marker=None, body_chunk_size=65536, timer=None):
+    # returns the status, the body length and the milliseconds from timer (started here when not given)
+    # until the response headers arrived
+    path = o.path or '/'
+    if o.query:
+        path += '?' + o.query
+
+    if pool is None:
+        pool = ConnectionPool.AsyncConnectionPool(max_idle=0, sock_timeout=sock_timeout)
+    request = 'GET {0} HTTP/1.1\r\nHost: {1}\r\n\r\n'.format(path, o.netloc).encode('latin-1')
+    if timer is None:
+        timer = TimerClass()
+
+    for attempt in range(2):
+        reader, writer, reused = await pool.acquire(o)
+        scanner = BodyScanner(status_marker)
+        try:
+            writer.write(request)
+            status, body_len, headers, elapsed = await asyncio.wait_for(
+                read_http_response(reader, scanner, body_chunk_size, timer), sock_timeout)
+        except (http.client.RemoteDisconnected, asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError):
+            writer.close()
+            # an idle connection the server has already closed, try once more on a new one
+            if reused and attempt == 0:
+                continue
+            raise
+        except BaseException:
+            writer.close()
+            raise
+
+        keep_alive = headers.get('connection', '').lower() != 'close' and \
+            ('content-length' in headers or headers.get('transfer-encoding', '').lower() == 'chunked')
+        pool.release(o, reader, writer, keep_alive)
+        if status == 200 and not scanner.found:
+            return STATUS_MARKER_MISSING, body_len, elapsed
+        return status, body_len, elapsed
+
+
+def make_results(failed, completed, elapsed, total_mb, histogram, intended_histogram):
+    return {
+        'failed': failed,
+        'completed': completed,
+        'rps': completed / elapsed if elapsed > 0 else 0,
+        'elapsed': elapsed,
+        'total_mb': total_mb,
+        'avg_ms': histogram.mean(),
+        'min_ms': histogram.get_min(),
+        'max_ms': histogram.get_max(),
+        'p50_ms': histogram.percentile(50),
+        'p90_ms': histogram.percentile(90),
+        'p99_ms': histogram.percentile(99),
+        'p999_ms': histogram.percentile(99.9),
+        'intended_avg_ms': intended_histogram.mean(),
+        'intended_max_ms': intended_histogram.get_max(),
+        'intended_p50_ms': intended_histogram.percentile(50),
+        'intended_p90_ms': intended_histogram.percentile(90),
+        'intended_p99_ms': intended_histogram.percentile(99),
+        'intended_p999_ms': intended_histogram.percentile(99.9),
+    }
+
+
+def merge_summaries(summaries):
+    merged = {
+        'failed': 0,
+        'completed': 0,
+        'total_bytes': 0,
+        'elapsed': 0,
+        'histogram': LatencyHistogram(),
+        'intended_histogram': LatencyHistogram(),
+    }
+    for summary in summaries:
+        merged['failed'] += summary['failed']
+        merged['completed'] += summary['completed']
+        merged['total_bytes'] += summary['total_bytes']
+        merged['elapsed'] = max(merged['elapsed'], summary['elapsed'])
+        merged['histogram'].merge(LatencyHistogram.from_dict(summary['histogram']))
+        merged['intended_histogram'].merge(LatencyHistogram.from_dict(summary['intended_histogram']))
+
+    # summaries of a URL mix hold one nested summary per endpoint url
+    endpoint_summaries = collections.OrderedDict()
+    for summary in summaries:
+        for url, endpoint_summary in summary.get('endpoints', {}).items():
+            endpoint_summaries.setdefault(url, []).append(endpoint_summary)
+    if endpoint_summaries:
+        merged['endpoints'] = collections.OrderedDict(
+            (url, merge_summaries(endpoint_summary)) for url, endpoint_summary in endpoint_summaries.items())
+    return merged
+
+
+def z_score(confidence):
+    # two-sided normal quantile, found by bisection on erf to avoid a scipy dependency
+    lo, hi = 0.0, 10.0
+    for i in range(60):
+        mid = (lo + hi) / 2
+        if math.erf(mid / math.sqrt(2)) < confidence:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+
+def relative_ci_width(statistic, histogram, windows, confidence):
+    """Width of the confidence interval of `statistic` relative to its estimate.
+
+    'mean' and 'throughput' use batch means over the closed per-interval windows, which copes with
+    the correlation between neighbouring requests. Percentiles such as 'p95' use the binomial
+    bounds on the rank of the order statistic, looked up in the run histogram.
+    """
+    z = z_score(confidence)
+    if statistic in ('mean', 'throughput'):
+        if statistic == 'mean':
+            values = [window['histogram'].mean() for window in windows if window['completed'] > 0]
+        else:
+            values = [window['completed'] for window in windows]
+        if len(values) < 5:
+            return math.inf
+        estimate = np.mean(values)
+        if estimate == 0:
+            return math.inf
+        return 2 * z * np.std(values, ddof=1) / math.sqrt(len(values)) / estimate
+    elif statistic.startswith('p'):
+        p = float(statistic[1:]) / 100.0
+        n = histogram.count
+        if n == 0:
+            return math.inf
+        spread = z * math.sqrt(n * p * (1 - p))
+        lo = histogram.percentile(max(n * p - spread, 1) * 100.0 / n)
+        hi = histogram.percentile(min(n * p + spread, n) * 100.0 / n)
+        estimate = histogram.percentile(p * 100.0)
+        if estimate == 0:
+            return math.inf
+        return (hi - lo) / estimate
+    else:
+        raise Exception("Invalid Early Stop Statistic!!!")
 
 
 seconds_per_unit = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
@@ -176,40 +843,157 @@ class LoadTester:
         self.timeout = kwargs.pop('timeout', '10s')
         self.warmup = kwargs.pop('warmup', '1s')
         self.num_of_clients = kwargs.pop('num_of_clients', 10)
+        self.sock_timeout = kwargs.pop('sock_timeout', 10)
+        # 'asyncio' runs the RPS mode and the Interactive users on a single event loop,
+        # 'thread' uses one ClientThread per request or per user
+        self.engine = kwargs.pop('engine', 'asyncio')
+        # Interactive mode: think times and sessions of every user, a SessionModel or its spec()
+        self.session = kwargs.pop('session', None)
+        if isinstance(self.session, dict):
+            self.session = UserSession.session_from_spec(self.session)
+        # keep-alive connections shared by every client of this tester, pool_size idle ones per host
+        self.keep_alive = kwargs.pop('keep_alive', True)
+        self.pool_size = kwargs.pop('pool_size', 100)
+        self.pool = ConnectionPool.ConnectionPool(max_idle=self.pool_size if self.keep_alive else 0,
+                                                  sock_timeout=self.sock_timeout)
+        self.async_pool = None
+        # response bodies are drained in body_chunk_size pieces and only counted, None keeps each body whole.
+        # status_marker (bytes) has to show up in the body of a 200, otherwise the request counts as failed
+        self.body_chunk_size = kwargs.pop('body_chunk_size', 65536)
+        self.status_marker = kwargs.pop('status_marker', None)
+        if isinstance(self.status_marker, str):
+            self.status_marker = self.status_marker.encode('utf-8')
+        # chunk buffers handed from finished client threads to new ones
+        self.body_buffers = collections.deque()
+        # per-interval time series, on_window is called with each window as it closes
+        self.window_interval = kwargs.pop('window_interval', 1.0)
+        self.max_windows = kwargs.pop('max_windows', 3600)
+        self.on_window = kwargs.pop('on_window', None)
+        # per-request records for records(), 24 bytes a request for the whole test
+        self.keep_records = kwargs.pop('keep_records', False)
+        # optional early stop: end the measurement once the confidence interval of early_stop ('mean',
+        # 'throughput' or a percentile like 'p95') is narrower than early_stop_width of its estimate
+        self.early_stop = kwargs.pop('early_stop', None)
+        self.early_stop_width = kwargs.pop('early_stop_width', 0.05)
+        self.early_stop_confidence = kwargs.pop('early_stop_confidence', 0.95)
+        self.early_stop_min_samples = kwargs.pop('early_stop_min_samples', 100)
+        self.early_stopped = False
         self.url = url
+        # url can be a weighted mix like {'http://10.2.6.171/cpu': 2, 'http://10.2.6.171/fileio': 1}, every
+        # endpoint is accounted separately on the common clock, see endpoint_results().
+        # endpoint_mix='request' picks the endpoint of each request at random by weight, 'user' gives every
+        # Interactive client a fixed endpoint in proportion to the weights
+        if isinstance(url, dict):
+            self.endpoints = list(url.keys())
+            self.endpoint_weights = [url[endpoint] for endpoint in self.endpoints]
+        else:
+            self.endpoints = [url]
+            self.endpoint_weights = [1]
+        self.endpoint_targets = [urlparse(endpoint) for endpoint in self.endpoints]
+        self.endpoint_cumulative = list(itertools.accumulate(self.endpoint_weights))
+        self.endpoint_mix = kwargs.pop('endpoint_mix', 'request')
+        self.endpoint_rng = random.Random(kwargs.pop('endpoint_seed', None))
+        self.user_endpoints = []
+        self.user_endpoint_credits = [0.0] * len(self.endpoints)
+        # id of this tester's first user, a shard of a MergedLoadTester goes on with the users of the shards
+        # before it, so endpoint_mix='user' and sessions follow one sequence across all shards
+        self.first_user_id = kwargs.pop('first_user_id', 0)
         self.start_time = 0
-        self.active_clients = []
-        self.latencies = []
-        self.fails = []
-        self.completed = []
+        self.measure_start = 0
+        self.measure_end = 0
+        # clients that have been started and are not done yet, they remove themselves through client_done()
+        self.active_clients = {}
+        self.clients_changed = threading.Condition()
+        self.started_clients = 0
+        self.finished_clients = 0
+        self.recorder = ResultRecorder(self.window_interval, self.max_windows, self.on_window, len(self.endpoints),
+                                       keep_records=self.keep_records)
+        self.histogram = self.recorder.histogram
+        self.intended_histogram = self.recorder.intended_histogram
 
-        self.ls = [0]
         self.total_completed = 0
         self.rps = 0
         self.total_mb = 0
         self.elapsed = 0
         self.rps_setpoint = 0.5
+        self.arrival = None
+        # bumped by set_rps()/set_arrival() so a running schedule picks up the new arrival process
+        self.arrival_version = 0
+        self.last_snapshot = None
         self.done = False
         self.rps_mode = False
+        # Interactive users running as coroutines, the tasks are only touched from users_loop
+        self.users_mode = False
+        self.users_loop = None
+        self.user_tasks = {}
+        self.users_end = 0
         self.stop_signal = False
 
-    def wait_for_active_clients(self, warmup=False):
-        while True:
-            time.sleep(0.05)
-            if not self.rps_mode:
-                if len(self.active_clients) == 0:
-                    return
-            # If in RPS mode
-            else:
-                if self.done or warmup:
-                    if len(self.active_clients) == 0:
-                        return
+    def start_client(self, client):
+        # registered before it starts so a client that finishes right away is still accounted for
+        with self.clients_changed:
+            self.active_clients[id(client)] = client
+            self.started_clients += 1
+        client.on_done = self.client_done
+        client.start()
+
+    def client_done(self, client):
+        with self.clients_changed:
+            del self.active_clients[id(client)]
+            self.finished_clients += 1
+            self.clients_changed.notify_all()
+
+    def set_done(self, done):
+        # the RPS schedule has ended (or started), wakes up wait_for_active_clients
+        with self.clients_changed:
+            self.done = done
+            self.clients_changed.notify_all()
+
+    def clients_finished(self, warmup=False):
+        if (self.rps_mode or self.users_mode) and not (self.done or warmup):
+            return False
+        return len(self.active_clients) == 0
+
+    def pick_endpoint(self):
+        if len(self.endpoints) == 1:
+            return 0, self.endpoint_targets[0]
+        point = self.endpoint_rng.random() * self.endpoint_cumulative[-1]
+        endpoint = bisect.bisect_right(self.endpoint_cumulative, point)
+        endpoint = min(endpoint, len(self.endpoints) - 1)
+        return endpoint, self.endpoint_targets[endpoint]
+
+    def user_endpoint(self, user_id):
+        # smooth weighted round robin, any window of users follows the weights as closely as possible
+        while len(self.user_endpoints) <= user_id:
+            total = sum(self.endpoint_weights)
+            for idx, weight in enumerate(self.endpoint_weights):
+                self.user_endpoint_credits[idx] += weight
+            endpoint = int(np.argmax(self.user_endpoint_credits))
+            self.user_endpoint_credits[endpoint] -= total
+            self.user_endpoints.append(endpoint)
+        return self.user_endpoints[user_id]
+
+    def client_endpoint_kwargs(self, user_id):
+        # ClientThread kwargs for an Interactive client of the mix
+        if len(self.endpoints) == 1:
+            return {}
+        if self.endpoint_mix == 'user':
+            return {'endpoint': self.user_endpoint(user_id)}
+        return {'pick_endpoint': self.pick_endpoint}
+
+    def body_kwargs(self):
+        # how ClientThreads read response bodies
+        return {'body_chunk_size': self.body_chunk_size, 'body_buffers': self.body_buffers,
+                'status_marker': self.status_marker}
 
-            for idx, client in enumerate(self.active_clients):
-                if client.done:
-                    # print(idx)
-                    del self.active_clients[idx]
-                    # print(len(active_clients))
+    def test_finished(self):
+        with self.clients_changed:
+            return self.clients_finished()
+
+    def wait_for_active_clients(self, warmup=False):
+        with self.clients_changed:
+            while not self.clients_finished(warmup):
+                self.clients_changed.wait()
 
     def tic(self):
         self.start_time = time.time()
@@ -222,116 +1006,653 @@ class LoadTester:
         print('{:4.02f}'.format(elapsed))
         return elapsed
 
+    def start_measurement(self, start_time):
+        self.measure_start = start_time
+        self.recorder.series.start(start_time)
+        ticker = threading.Thread(target=self.window_ticker, daemon=True)
+        ticker.start()
+        if self.early_stop is not None:
+            monitor = threading.Thread(target=self.early_stop_monitor, daemon=True)
+            monitor.start()
+
+    def window_ticker(self):
+        # closes windows on time even when no request completes in them
+        end_time = self.measure_start + convert_to_seconds(self.timeout)
+        while time.time() < end_time and not self.stop_signal:
+            time.sleep(self.window_interval)
+            self.recorder.series.advance()
+
+    def early_stop_monitor(self):
+        end_time = self.measure_start + convert_to_seconds(self.timeout)
+        while time.time() < end_time and not self.stop_signal:
+            time.sleep(self.window_interval)
+            if self.recorder.completed_count() < self.early_stop_min_samples:
+                continue
+            windows = [window for window in self.recorder.series.time_series(include_histogram=True)[:-1]]
+            width = relative_ci_width(self.early_stop, self.histogram, windows, self.early_stop_confidence)
+            if width <= self.early_stop_width:
+                print('Early stop: {0} confidence interval within {1:4.02f}% after {2:4.02f}s'.format(
+                    self.early_stop, width * 100, time.time() - self.measure_start))
+                self.early_stopped = True
+                self.stop_test()
+
+    def measured_time(self):
+        if self.measure_start == 0:
+            return 0
+        now = time.time() if self.measure_end == 0 else self.measure_end
+        return min(max(now - self.measure_start, 0), convert_to_seconds(self.timeout))
+
+    def time_series(self, include_histogram=False):
+        return self.recorder.series.time_series(include_histogram)
+
+    def set_num_of_clients(self, num_of_clients):
+        # Interactive mode: start or stop clients without restarting the test
+        if self.users_mode:
+            self.call_in_users_loop(self.resize_users, num_of_clients)
+            self.num_of_clients = num_of_clients
+            return
+        with self.clients_changed:
+            running = [client for client in self.active_clients.values() if not client.stop_signal]
+        if num_of_clients < len(running):
+            for client in running[num_of_clients:]:
+                client.stop_client()
+        elif num_of_clients > len(running):
+            remaining = self.measure_start + convert_to_seconds(self.timeout) - time.time()
+            for i in range(num_of_clients - len(running)):
+                user_id = self.first_user_id + self.started_clients
+                client_kwargs = dict(self.client_endpoint_kwargs(user_id), **self.body_kwargs())
+                self.start_client(ClientThread(self.endpoints[client_kwargs.get('endpoint', 0)], self.recorder,
+                                               timeout=remaining, warmup=0, pool=self.pool, session=self.session,
+                                               user_id=user_id, **client_kwargs))
+        self.num_of_clients = num_of_clients
+
+    def set_arrival(self, arrival):
+        # RPS mode: the running schedule restarts from now with the new arrival process
+        self.arrival = arrival
+        self.rps_setpoint = arrival.rps
+        self.arrival_version += 1
+
+    def set_rps(self, rps):
+        if isinstance(self.arrival, ArrivalProcess.PoissonArrival):
+            self.set_arrival(ArrivalProcess.PoissonArrival(rps))
+        else:
+            self.set_arrival(ArrivalProcess.ConstantArrival(rps))
+
+    def arrival_offsets(self, clock):
+        # offsets from the phase start, clock() gives the time since the phase start. set_arrival() restarts
+        # the new process from now, a process that runs out (e.g. a short trace) ends the schedule
+        while True:
+            version = self.arrival_version
+            base = clock()
+            for offset in self.arrival.offsets():
+                if self.arrival_version != version:
+                    break
+                yield base + offset
+            if self.arrival_version == version:
+                return
+
+    def snapshot(self):
+        # results since the previous snapshot, or since the measurement started
+        now = time.time()
+        current = {
+            'time': now,
+            'failed': self.recorder.failed_count(),
+            'completed': self.recorder.completed_count(),
+            'total_bytes': self.recorder.total_bytes(),
+            'histogram': self.histogram.copy(),
+            'intended_histogram': self.intended_histogram.copy(),
+        }
+        previous = self.last_snapshot
+        if previous is None:
+            previous = {
+                'time': self.measure_start,
+                'failed': 0,
+                'completed': 0,
+                'total_bytes': 0,
+                'histogram': LatencyHistogram(),
+                'intended_histogram': LatencyHistogram(),
+            }
+        self.last_snapshot = current
+
+        completed = current['completed'] - previous['completed']
+        total_mb = (current['total_bytes'] - previous['total_bytes']) * 1.0 / 1024.0 / 1024.0
+        return make_results(current['failed'] - previous['failed'], completed,
+                            max(now - max(previous['time'], self.measure_start), 0), total_mb,
+                            current['histogram'].difference(previous['histogram']),
+                            current['intended_histogram'].difference(previous['intended_histogram']))
+
     def perform_test(self):
         self.perform_test_async()
 
         self.wait_for_test_results()
 
-    def perform_test_rps_async(self, rps=0.5):
+    def perform_test_rps_async(self, rps=0.5, arrival=None):
+        # arrival is an ArrivalProcess object, a constant rate of rps is used when it is not given
         self.rps_mode = True
-        self.done = False
+        self.set_done(False)
         self.rps_setpoint = rps
+        self.arrival = ArrivalProcess.ConstantArrival(rps) if arrival is None else arrival
         t1 = threading.Thread(target=self.perform_test_rps, daemon=True)
         t1.start()
 
     def perform_test_rps(self):
+        if self.engine == 'asyncio':
+            self.perform_test_rps_asyncio()
+        elif self.engine == 'thread':
+            self.perform_test_rps_threaded()
+        else:
+            raise Exception("Invalid Load Tester Engine!!!")
+
+    def perform_test_rps_asyncio(self):
         self.rps_mode = True
-        self.done = False
+        self.set_done(False)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.rps_engine())
+        finally:
+            loop.close()
+            self.set_done(True)
+            self.rps_mode = False
+
+    async def rps_engine(self):
         time_in_secs = convert_to_seconds(self.timeout)
         warmup_in_secs = convert_to_seconds(self.warmup)
+        in_flight = set()
+        self.async_pool = ConnectionPool.AsyncConnectionPool(max_idle=self.pool_size if self.keep_alive else 0,
+                                                             sock_timeout=self.sock_timeout)
 
-        timer = TimerClass()
+        await self.open_loop_schedule(warmup_in_secs, time_in_secs, in_flight)
+
+        if len(in_flight) > 0:
+            await asyncio.gather(*in_flight)
+        self.async_pool.close()
 
-        # perform warmup
-        print("warming up...")
+    def begin_phase(self, measured):
+        print("starting the test..." if measured else "warming up...")
         self.tic()
-        
-        while self.toc() < warmup_in_secs and not self.stop_signal:
-            timer.tic()
-            client = ClientThread(self.url, [], [], [], single=True)
-            client.start()
-            self.active_clients.append(client)
+        if measured:
+            self.start_measurement(self.start_time)
+
+    async def open_loop_schedule(self, warmup, duration, in_flight):
+        # Arrivals follow a fixed schedule from the start of the warmup, so a slow iteration
+        # is caught up on instead of pushing every later request back. The measured phase goes on
+        # with the same arrivals where the warmup left off, a trace is not replayed from its start again
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        recorder = None
+        self.begin_phase(False)
+        for intended in self.arrival_offsets(lambda: loop.time() - start):
+            if self.stop_signal:
+                break
+            if recorder is None and intended >= warmup:
+                await asyncio.sleep(max(start + warmup - loop.time(), 0))
+                self.begin_phase(True)
+                recorder = self.recorder
+            if intended >= warmup + duration:
+                break
 
-            wait_time = (1 / self.rps_setpoint) - timer.toc()
+            wait_time = start + intended - loop.time()
             if wait_time > 0:
-                time.sleep(wait_time)
+                await asyncio.sleep(wait_time)
 
-        # Perform the test
-        print("starting the test...")
+            endpoint, o = self.pick_endpoint()
+            task = loop.create_task(self.async_request(o, recorder, start + intended, endpoint))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if recorder is None:
+            # the arrivals ran out or the test was stopped during the warmup
+            if not self.stop_signal:
+                await asyncio.sleep(max(start + warmup - loop.time(), 0))
+            self.begin_phase(True)
 
-        self.tic()
-        while self.toc() < time_in_secs and not self.stop_signal:
-            timer.tic()
+    async def async_request(self, o, recorder, intended_at, endpoint=0):
+        # warmup requests get no recorder, intended_at is the scheduled send time on the loop clock
+        send_delay = max(asyncio.get_event_loop().time() - intended_at, 0) * 1000
+        timer = TimerClass()
+        try:
+            status, body_len, elapsed = await async_http_get(o, self.sock_timeout, self.async_pool,
+                                                             self.status_marker, self.body_chunk_size, timer)
+        except http.client.RemoteDisconnected:
+            if recorder is not None:
+                recorder.record_fail(0, endpoint)
+            return
+        except ConnectionResetError:
+            return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, OSError, ValueError):
+            if recorder is not None:
+                recorder.record_fail(0, endpoint)
+            return
+
+        if recorder is None:
+            return
+
+        if status == 200:
+            recorder.record(elapsed, body_len, send_delay + elapsed, endpoint)
+        elif status == 301:
+            raise Exception('Got Forward page 301 status!')
+        else:
+            recorder.record_fail(status, endpoint)
+            if status != STATUS_MARKER_MISSING:
+                print(status)
+
+    def perform_test_rps_threaded(self):
+        self.rps_mode = True
+        self.set_done(False)
+        time_in_secs = convert_to_seconds(self.timeout)
+        warmup_in_secs = convert_to_seconds(self.warmup)
+
+        self.threaded_schedule(warmup_in_secs, time_in_secs)
+        self.set_done(True)
+        self.rps_mode = False
 
-            client = ClientThread(self.url, self.latencies, self.fails, self.completed, single=True)
-            client.start()
-            self.active_clients.append(client)
+    def threaded_schedule(self, warmup, duration):
+        # sleep towards the next scheduled arrival so a slow client.start() doesn't shift the rest, the
+        # schedule runs on from the warmup into the measured phase like open_loop_schedule
+        self.begin_phase(False)
+        start = self.start_time
+        recorder = None
+        for intended in self.arrival_offsets(lambda: time.time() - start):
+            if self.stop_signal:
+                break
+            if recorder is None and intended >= warmup:
+                time.sleep(max(start + warmup - time.time(), 0))
+                self.begin_phase(True)
+                recorder = self.recorder
+            if intended >= warmup + duration:
+                break
 
-            wait_time = (1 / self.rps_setpoint) - timer.toc()
+            wait_time = start + intended - time.time()
             if wait_time > 0:
                 time.sleep(wait_time)
-        self.done = True
-        self.rps_mode = False
+
+            endpoint, o = self.pick_endpoint()
+            self.start_client(ClientThread(self.endpoints[endpoint], recorder, single=True, pool=self.pool,
+                                           intended_time=start + intended, endpoint=endpoint,
+                                           **self.body_kwargs()))
+        if recorder is None:
+            if not self.stop_signal:
+                time.sleep(max(start + warmup - time.time(), 0))
+            self.begin_phase(True)
 
     def stop_test(self):
+        if self.measure_start != 0 and self.measure_end == 0:
+            self.measure_end = time.time()
         self.stop_signal = True
-        for client in self.active_clients:
+        with self.clients_changed:
+            clients = list(self.active_clients.values())
+        for client in clients:
             client.stop_client()
+        if self.users_mode:
+            self.call_in_users_loop(self.resize_users, 0)
 
     def perform_test_async(self):
+        if self.engine == 'asyncio':
+            self.perform_test_users_async()
+            return
+
         time_in_secs = convert_to_seconds(self.timeout)
         warmup_in_secs = convert_to_seconds(self.warmup)
 
         self.tic()
+        self.start_measurement(self.start_time + warmup_in_secs)
         for i in range(self.num_of_clients):
-            client = ClientThread(self.url, self.latencies, self.fails, self.completed,
-                                  timeout=time_in_secs, warmup=warmup_in_secs)
-            client.start()
-            self.active_clients.append(client)
+            user_id = self.first_user_id + i
+            client_kwargs = dict(self.client_endpoint_kwargs(user_id), **self.body_kwargs())
+            self.start_client(ClientThread(self.endpoints[client_kwargs.get('endpoint', 0)], self.recorder,
+                                           timeout=time_in_secs, warmup=warmup_in_secs, pool=self.pool,
+                                           session=self.session, user_id=user_id, **client_kwargs))
+
+    def perform_test_users_async(self):
+        # Interactive mode with every user as a coroutine, so thousands of users don't need a thread each
+        self.users_mode = True
+        self.set_done(False)
+        self.tic()
+        t1 = threading.Thread(target=self.perform_test_users, daemon=True)
+        t1.start()
+
+    def perform_test_users(self):
+        loop = asyncio.new_event_loop()
+        self.users_loop = loop
+        try:
+            loop.run_until_complete(self.users_engine())
+        finally:
+            self.users_loop = None
+            loop.close()
+            self.set_done(True)
+
+    def call_in_users_loop(self, callback, *args):
+        loop = self.users_loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # the loop has just been closed, the users are done anyway
+            pass
+
+    async def users_engine(self):
+        time_in_secs = convert_to_seconds(self.timeout)
+        warmup_in_secs = convert_to_seconds(self.warmup)
+        self.async_pool = ConnectionPool.AsyncConnectionPool(max_idle=self.pool_size if self.keep_alive else 0,
+                                                             sock_timeout=self.sock_timeout)
+        self.users_end = self.start_time + warmup_in_secs + time_in_secs
+        self.start_measurement(self.start_time + warmup_in_secs)
+        if not self.stop_signal:
+            self.resize_users(self.num_of_clients)
+
+        # the loop keeps running with no users left, set_num_of_clients() may add some until the test ends
+        while not self.stop_signal:
+            remaining = self.users_end - time.time()
+            if remaining <= 0:
+                break
+            if len(self.user_tasks) > 0:
+                await asyncio.wait(list(self.user_tasks), timeout=min(remaining, 0.1))
+            else:
+                await asyncio.sleep(min(remaining, 0.1))
+        while len(self.user_tasks) > 0:
+            await asyncio.wait(list(self.user_tasks))
+        self.async_pool.close()
+
+    def resize_users(self, num_of_clients):
+        # runs on users_loop, the newest users are stopped first
+        tasks = list(self.user_tasks)
+        if num_of_clients < len(tasks):
+            for task in tasks[num_of_clients:]:
+                task.cancel()
+        else:
+            for i in range(num_of_clients - len(tasks)):
+                task = asyncio.get_event_loop().create_task(self.virtual_user(self.first_user_id +
+                                                                                  self.started_clients))
+                self.started_clients += 1
+                self.user_tasks[task] = True
+                task.add_done_callback(self.user_done)
+
+    def user_done(self, task):
+        del self.user_tasks[task]
+        self.finished_clients += 1
+
+    async def virtual_user(self, user_id):
+        pauses = None if self.session is None else self.session.pauses(user_id)
+        loop = asyncio.get_event_loop()
+        if self.endpoint_mix == 'user':
+            endpoint = self.user_endpoint(user_id)
+            o = self.endpoint_targets[endpoint]
+        while not self.stop_signal and time.time() < self.users_end:
+            if self.endpoint_mix != 'user':
+                endpoint, o = self.pick_endpoint()
+            # requests of the warmup period are not recorded
+            recorder = self.recorder if time.time() >= self.measure_start else None
+            await self.async_request(o, recorder, loop.time(), endpoint)
+            if pauses is not None:
+                pause = min(next(pauses), self.users_end - time.time())
+                if pause > 0:
+                    await asyncio.sleep(pause)
 
     def wait_for_test_results(self, warmup=False):
         self.wait_for_active_clients(warmup)
         self.prepare_results()
 
     def prepare_results(self):
-        warmup_in_secs = convert_to_seconds(self.warmup)
-        self.elapsed = self.toc() - warmup_in_secs
-        self.ls = np.array(self.latencies)
-        self.total_completed = len(self.completed)
-        self.rps = self.total_completed / self.elapsed
-        self.total_mb = np.sum(self.completed) * 1.0 / 1024.0 / 1024.0
+        self.recorder.series.advance()
+        self.elapsed = self.measured_time()
+        self.total_completed = self.recorder.completed_count()
+        self.rps = self.total_completed / self.elapsed if self.elapsed > 0 else 0
+        self.total_mb = self.recorder.total_bytes() * 1.0 / 1024.0 / 1024.0
 
     def print_results(self):
-        print("Failed: ", len(self.fails), 'Num of Clients: ', self.num_of_clients)
+        print("Failed: ", self.recorder.failed_count(), 'Num of Clients: ', self.num_of_clients)
         print("Completed: {0}, Elapsed: {2:4.2f}, RPS: {1:4.02f}".format(self.total_completed, self.rps, self.elapsed))
         print("Total MB Rec: {0:4.02f}, Transfer Rate: {1:4.02f} MB/s".format(self.total_mb,
                                                                               self.total_mb / self.elapsed))
-        if len(self.ls) == 0:
-            self.ls = [0]
-        print('Avg: {0:4.02f} ms, min: {1:4.02f} ms, max: {2:4.02f} ms'.format(np.average(self.ls), np.min(self.ls),
-                                                                               np.max(self.ls)))
+        print('Avg: {0:4.02f} ms, min: {1:4.02f} ms, max: {2:4.02f} ms'.format(self.histogram.mean(),
+                                                                               self.histogram.get_min(),
+                                                                               self.histogram.get_max()))
+        print('p50: {0:4.02f} ms, p90: {1:4.02f} ms, p99: {2:4.02f} ms, p99.9: {3:4.02f} ms'.format(
+            self.histogram.percentile(50), self.histogram.percentile(90), self.histogram.percentile(99),
+            self.histogram.percentile(99.9)))
+        print('From intended send time - Avg: {0:4.02f} ms, p99: {1:4.02f} ms, max: {2:4.02f} ms'.format(
+            self.intended_histogram.mean(), self.intended_histogram.percentile(99),
+            self.intended_histogram.get_max()))
 
-    result_keys = ['failed', 'completed', 'rps', 'elapsed', 'total_mb', 'avg_ms', 'min_ms', 'max_ms']
+    result_keys = ['failed', 'completed', 'rps', 'elapsed', 'total_mb', 'avg_ms', 'min_ms', 'max_ms',
+                   'p50_ms', 'p90_ms', 'p99_ms', 'p999_ms', 'intended_avg_ms', 'intended_max_ms',
+                   'intended_p50_ms', 'intended_p90_ms', 'intended_p99_ms', 'intended_p999_ms']
 
     def get_latencies(self):
-        return self.ls
+        return self.histogram
 
     def results(self):
-        if len(self.ls) == 0:
-            self.ls = [0]
+        return make_results(self.recorder.failed_count(), self.total_completed, self.elapsed, self.total_mb,
+                            self.histogram, self.intended_histogram)
+
+    def endpoint_results(self):
+        # results() of every url of the mix, over the same elapsed time
+        completed, failed, total_bytes = self.recorder.endpoint_totals()
+        ret = collections.OrderedDict()
+        for idx, url in enumerate(self.endpoints):
+            ret[url] = make_results(int(failed[idx]), int(completed[idx]), self.elapsed,
+                                    total_bytes[idx] / 1024.0 / 1024.0, self.recorder.endpoint_histograms[idx],
+                                    self.recorder.endpoint_intended_histograms[idx])
+        return ret
+
+    def records(self):
+        # per-request records of the test as a structured array, see ResultBuffer.dtype
+        return self.recorder.records()
+
+    def summary(self):
+        elapsed = self.measured_time()
         ret = {
-            'failed': len(self.fails),
-            'completed': self.total_completed,
-            'rps': self.rps,
-            'elapsed': self.elapsed,
-            'total_mb': self.total_mb,
-            'avg_ms': np.average(self.ls),
-            'min_ms': np.min(self.ls),
-            'max_ms': np.max(self.ls),
+            'failed': self.recorder.failed_count(),
+            'completed': self.recorder.completed_count(),
+            'total_bytes': int(self.recorder.total_bytes()),
+            'elapsed': elapsed,
+            'histogram': self.histogram.to_dict(),
+            'intended_histogram': self.intended_histogram.to_dict(),
         }
+        if len(self.endpoints) > 1:
+            completed, failed, total_bytes = self.recorder.endpoint_totals()
+            ret['endpoints'] = collections.OrderedDict()
+            for idx, url in enumerate(self.endpoints):
+                ret['endpoints'][url] = {
+                    'failed': int(failed[idx]),
+                    'completed': int(completed[idx]),
+                    'total_bytes': int(total_bytes[idx]),
+                    'elapsed': elapsed,
+                    'histogram': self.recorder.endpoint_histograms[idx].to_dict(),
+                    'intended_histogram': self.recorder.endpoint_intended_histograms[idx].to_dict(),
+                }
         return ret
 
 
+def report_until_finished(tester, report_interval, report, stop_requested):
+    # calls report(final, summary) every report_interval seconds until the tester is done
+    timer = TimerClass()
+    while not tester.test_finished():
+        if stop_requested():
+            tester.stop_test()
+        if timer.toc() >= report_interval:
+            timer.tic()
+            report(False, tester.summary())
+        time.sleep(0.05)
+
+    report(True, tester.summary())
+
+
+def run_load_shard(shard_id, url, tester_kwargs, rps, arrival, stop_event, result_queue, report_interval):
+    tester = LoadTester(url, **tester_kwargs)
+    if rps is None:
+        tester.perform_test_async()
+    else:
+        tester.perform_test_rps_async(rps=rps, arrival=arrival)
+
+    report_until_finished(tester, report_interval,
+                          lambda final, summary: result_queue.put((shard_id, final, summary)),
+                          stop_event.is_set)
+
+
+class MergedLoadTester(abc.ABC):
+    """Base for testers that split one test into shards and merge their summaries.
+
+    Interactive clients or the RPS setpoint are split evenly over `shard_count` shards. Each shard
+    streams a compact summary every `report_interval` seconds, so results() also works mid-test.
+    Subclasses start the shards, fill `shard_summaries` and add finished ones to `shards_done`.
+    """
+    def __init__(self, url, shard_count, **kwargs):
+        self.shard_count = shard_count
+        self.report_interval = kwargs.pop('report_interval', 5)
+        self.num_of_clients = kwargs.pop('num_of_clients', 10)
+        self.timeout = kwargs.get('timeout', '10s')
+        self.warmup = kwargs.get('warmup', '1s')
+        self.tester_kwargs = kwargs
+        self.url = url
+
+        self.shard_summaries = {}
+        self.shards_done = set()
+        self.endpoint_summaries = {}
+
+        self.histogram = LatencyHistogram()
+        self.intended_histogram = LatencyHistogram()
+        self.fails = 0
+        self.total_completed = 0
+        self.rps = 0
+        self.total_mb = 0
+        self.elapsed = 0
+
+    @abc.abstractmethod
+    def start_shards(self, shard_loads, rps_mode, shard_arrivals=None):
+        pass
+
+    @abc.abstractmethod
+    def stop_test(self):
+        pass
+
+    @abc.abstractmethod
+    def wait_for_test_results(self, warmup=False):
+        pass
+
+    def perform_test(self):
+        self.perform_test_async()
+
+        self.wait_for_test_results()
+
+    def perform_test_async(self):
+        base, extra = divmod(self.num_of_clients, self.shard_count)
+        shard_loads = [base + (1 if i < extra else 0) for i in range(self.shard_count)]
+        self.start_shards([load for load in shard_loads if load > 0], rps_mode=False)
+
+    def perform_test_rps_async(self, rps=0.5, arrival=None):
+        if arrival is None:
+            arrival = ArrivalProcess.ConstantArrival(rps)
+        self.start_shards([rps / self.shard_count] * self.shard_count, rps_mode=True,
+                          shard_arrivals=arrival.split(self.shard_count))
+
+    def prepare_results(self):
+        merged = merge_summaries(list(self.shard_summaries.values()))
+        self.histogram = merged['histogram']
+        self.intended_histogram = merged['intended_histogram']
+        self.fails = merged['failed']
+        self.total_completed = merged['completed']
+        self.elapsed = merged['elapsed']
+        self.total_mb = merged['total_bytes'] * 1.0 / 1024.0 / 1024.0
+        self.rps = self.total_completed / self.elapsed if self.elapsed > 0 else 0
+        self.endpoint_summaries = merged.get('endpoints', {})
+
+    def print_results(self):
+        print("Failed: ", self.fails, 'Num of Clients: ', self.num_of_clients, 'Shards: ', self.shard_count)
+        print("Completed: {0}, Elapsed: {2:4.2f}, RPS: {1:4.02f}".format(self.total_completed, self.rps, self.elapsed))
+        print('Avg: {0:4.02f} ms, min: {1:4.02f} ms, max: {2:4.02f} ms'.format(self.histogram.mean(),
+                                                                               self.histogram.get_min(),
+                                                                               self.histogram.get_max()))
+        print('p50: {0:4.02f} ms, p90: {1:4.02f} ms, p99: {2:4.02f} ms, p99.9: {3:4.02f} ms'.format(
+            self.histogram.percentile(50), self.histogram.percentile(90), self.histogram.percentile(99),
+            self.histogram.percentile(99.9)))
+        print('From intended send time - Avg: {0:4.02f} ms, p99: {1:4.02f} ms, max: {2:4.02f} ms'.format(
+            self.intended_histogram.mean(), self.intended_histogram.percentile(99),
+            self.intended_histogram.get_max()))
+
+    result_keys = LoadTester.result_keys
+
+    def get_latencies(self):
+        return self.histogram
+
+    def results(self):
+        return make_results(self.fails, self.total_completed, self.elapsed, self.total_mb, self.histogram,
+                            self.intended_histogram)
+
+    def endpoint_results(self):
+        if not self.endpoint_summaries:
+            return collections.OrderedDict([(self.url, self.results())])
+        return collections.OrderedDict(
+            (url, make_results(summary['failed'], summary['completed'], self.elapsed,
+                               summary['total_bytes'] * 1.0 / 1024.0 / 1024.0, summary['histogram'],
+                               summary['intended_histogram']))
+            for url, summary in self.endpoint_summaries.items())
+
+
+class ShardedLoadTester(MergedLoadTester):
+    """Runs a LoadTester per process and merges their results."""
+    def __init__(self, url, *args, **kwargs):
+        processes = kwargs.pop('processes', multiprocessing.cpu_count())
+        super(ShardedLoadTester, self).__init__(url, processes, **kwargs)
+        self.processes = processes
+
+        self.shards = []
+        self.stop_event = multiprocessing.Event()
+        self.result_queue = multiprocessing.Queue()
+        self.collector = None
+
+    def start_shards(self, shard_loads, rps_mode, shard_arrivals=None):
+        self.stop_event.clear()
+        self.shard_summaries = {}
+        self.shards_done = set()
+        self.shards = []
+        for shard_id, shard_load in enumerate(shard_loads):
+            tester_kwargs = dict(self.tester_kwargs)
+            if rps_mode:
+                rps = shard_load
+            else:
+                rps = None
+                tester_kwargs['num_of_clients'] = shard_load
+                # users go on from the shards before, the endpoint mix and sessions are assigned over all of them
+                tester_kwargs['first_user_id'] = int(sum(shard_loads[:shard_id]))
+            shard = multiprocessing.Process(target=run_load_shard,
+                                            args=(shard_id, self.url, tester_kwargs, rps,
+                                                  None if shard_arrivals is None else shard_arrivals[shard_id],
+                                                  self.stop_event, self.result_queue, self.report_interval),
+                                            daemon=True)
+            shard.start()
+            self.shards.append(shard)
+
+        self.collector = threading.Thread(target=self.collect_summaries, daemon=True)
+        self.collector.start()
+
+    def collect_summaries(self):
+        while len(self.shards_done) < len(self.shards):
+            try:
+                shard_id, final, summary = self.result_queue.get(timeout=1)
+            except queue.Empty:
+                # a shard process that died before its final summary would otherwise be waited for forever,
+                # the queue is empty so whatever it managed to send has been collected
+                for shard_id, shard in enumerate(self.shards):
+                    if shard_id not in self.shards_done and not shard.is_alive():
+                        print('Load shard', shard_id, 'exited without its final results, exit code', shard.exitcode)
+                        self.shards_done.add(shard_id)
+                continue
+            self.shard_summaries[shard_id] = summary
+            if final:
+                self.shards_done.add(shard_id)
+
+    def stop_test(self):
+        self.stop_event.set()
+
+    def wait_for_test_results(self, warmup=False):
+        self.collector.join()
+        for shard in self.shards:
+            shard.join()
+        self.prepare_results()
+
+
 if __name__ == '__main__':
     # tester = LoadTester('https://google.com/', timeout='3s', num_of_clients=1)
     # tester.perform_test()
@@ -1,6 +1,7 @@
 """
 Robust Consumer that will automatically re-connect on failure.
 """
+import collections
 import logging
 import random
 import time
@@ -13,7 +14,11 @@ from amqpstorm import Connection
 
 import RabbitServerInfo as info
 import DockerRemoteAPI as api
-from ELSbeat import metricbeat
+from ELSbeat import metricbeat, MetricsCache
+from ProcMetrics import ProcMetrics
+import ArrivalProcess
+import Calibration
+import LoadAgent
 import LoadTester
 
 logging.basicConfig(level=logging.INFO)
@@ -131,7 +136,9 @@ class ApiServer(object):
 
 
 class Manager(object):
-    def __init__(self, elastic_server_ip, elastic_server_port, profiler, workers):
+    def __init__(self, elastic_server_ip, elastic_server_port, profiler, workers, load_processes=1,
+                 load_agents=None, generator_calibration=None, server_side_stats=False, cache_worker_stats=False,
+                 metrics_backend='metricbeat'):
         self.elastic_server_ip = elastic_server_ip
         self.elastic_server_port = elastic_server_port
         self.profiler = profiler
@@ -152,6 +159,60 @@ class Manager(object):
             self.worker_apis.append(worker_api)
 
         self.test_load_testers = []
+        # more than one process shards each load test with LoadTester.ShardedLoadTester
+        self.load_processes = load_processes
+        # urls of LoadAgent daemons, when given every load test is fanned out to them
+        self.load_agents = load_agents
+        # result of Calibration.calibrate() or the path of a saved one, used to warn about generator limited tests
+        if isinstance(generator_calibration, str):
+            generator_calibration = Calibration.load_calibration(generator_calibration)
+        self.generator_calibration = generator_calibration
+        # have Elasticsearch aggregate the worker statistics instead of fetching the raw samples
+        self.server_side_stats = server_side_stats
+        # one long-lived backend for every statistics query, the hostname is given per call. 'proc' reads the
+        # /proc collector of every node API instead of Metricbeat samples from Elasticsearch
+        if metrics_backend == 'metricbeat':
+            self.metrics_backend = metricbeat(self.elastic_server_ip, self.elastic_server_port, self.profiler.id)
+        elif metrics_backend == 'proc':
+            api_urls = {node.id: node.get_api_url() for node in list(self.workers) + [self.profiler]}
+            self.metrics_backend = ProcMetrics(api_urls, self.profiler.id)
+        else:
+            raise Exception("Invalid Metrics Backend!!!")
+        # keep the worker samples between update_worker_stats calls and fetch only the new ones
+        self.cache_worker_stats = cache_worker_stats
+        self.worker_stats_cache = None
+
+    def create_load_tester(self, url, **kwargs):
+        if self.load_agents:
+            return LoadAgent.RemoteLoadTester(url, agents=self.load_agents, **kwargs)
+        if self.load_processes > 1:
+            return LoadTester.ShardedLoadTester(url, processes=self.load_processes, **kwargs)
+        return LoadTester.LoadTester(url, **kwargs)
+
+    def calibrate_load_generator(self, **kwargs):
+        self.generator_calibration = Calibration.calibrate(**kwargs)
+        Calibration.print_calibration(self.generator_calibration)
+        return self.generator_calibration
+
+    def generator_max_rps(self, test_mode='RPS'):
+        # the calibration covers one local process, nothing is known about remote agents
+        if self.generator_calibration is None or self.load_agents:
+            return None
+        return self.generator_calibration[test_mode]['max_rps'] * self.load_processes
+
+    def check_generator_load(self, test_mode='RPS', target_rps=None, achieved_rps=None, margin=0.9):
+        max_rps = self.generator_max_rps(test_mode)
+        if max_rps is None:
+            return True
+        if target_rps is not None and test_mode == 'RPS' and target_rps > max_rps:
+            print('WARNING: requested {0:4.02f} rps, the load generator sustains only {1:4.02f} rps!'.format(
+                target_rps, max_rps))
+            return False
+        if achieved_rps is not None and achieved_rps > max_rps * margin:
+            print('WARNING: {0:4.02f} rps is close to the load generator limit of {1:4.02f} rps, '
+                  'results may be generator bound!'.format(achieved_rps, max_rps))
+            return False
+        return True
 
     def prepare_profile(self, package):
         # We should only have one instance of this container, delete all before it
@@ -227,18 +288,26 @@ class Manager(object):
 
         # Start the load testing
         if test_mode == "RPS":
-            load_tester = LoadTester.LoadTester(package.test_url, timeout=test_time, warmup=warmup_time)
-            load_tester.perform_test_rps_async(rps=target_profile['target_rps'])
+            load_tester = self.create_load_tester(package.test_url, timeout=test_time, warmup=warmup_time)
+            arrival = ArrivalProcess.create_scaled_arrival(target_profile.get('arrival_process', 'constant'),
+                                                           target_profile['target_rps'],
+                                                           **target_profile.get('arrival_kwargs', {}))
+            load_tester.perform_test_rps_async(rps=target_profile['target_rps'], arrival=arrival)
         elif test_mode == "Interactive":
-            load_tester = LoadTester.LoadTester(package.test_url, timeout=test_time, warmup=warmup_time,
-                                                num_of_clients=int(target_profile['num_of_clients']))
+            load_tester = self.create_load_tester(package.test_url, timeout=test_time, warmup=warmup_time,
+                                                  num_of_clients=int(target_profile['num_of_clients']),
+                                                  session=target_profile.get('session'))
             load_tester.perform_test_async()
         else:
             raise Exception("Invalid Test Mode!!!")
 
         return load_tester
 
-    def prepare_worker(self, tests_targets, worker_num=0, test_mode='RPS'):
+    def prepare_worker(self, tests_targets, worker_num=0, test_mode='RPS', arrival_process='constant',
+                       arrival_kwargs=None):
+        if arrival_kwargs is None:
+            arrival_kwargs = {}
+
         # We clear profiler for this task as well, so it won't respond to tasks
         self.profiler_api.delete_all()
         # We should only have one instance of this container, delete all before it
@@ -280,8 +349,10 @@ class Manager(object):
                 all_post_delays.append(package.post_delay)
 
                 if count > 0:
-                    load_tester = LoadTester.LoadTester(package.test_url, timeout='24h', warmup='30s')
-                    load_tester.perform_test_rps_async(rps=rps_each * count)
+                    load_tester = self.create_load_tester(package.test_url, timeout='24h', warmup='30s')
+                    arrival = ArrivalProcess.create_scaled_arrival(arrival_process, rps_each * count,
+                                                                   **arrival_kwargs)
+                    load_tester.perform_test_rps_async(rps=rps_each * count, arrival=arrival)
                     self.test_load_testers.append(load_tester)
         elif test_mode == "Interactive":
             for test_state in test_states:
@@ -291,8 +362,8 @@ class Manager(object):
                 all_post_delays.append(package.post_delay)
 
                 if count > 0:
-                    load_tester = LoadTester.LoadTester(package.test_url, timeout='24h', warmup='30s',
-                                                num_of_clients=users_each * count)
+                    load_tester = self.create_load_tester(package.test_url, timeout='24h', warmup='30s',
+                                                          num_of_clients=users_each * count)
                     load_tester.perform_test_async()
                     self.test_load_testers.append(load_tester)
 
@@ -310,11 +381,13 @@ class Manager(object):
 
         print('All load testers have been stopped!')
 
-    def profile(self, package, warmup_time, test_time, target_rps, accepted_stats, count=10, test_mode='RPS'):
+    def profile(self, package, warmup_time, test_time, target_rps, accepted_stats, count=10, test_mode='RPS',
+                early_stop_kwargs=None, cooldown='30s'):
         all_results = None
         for i in range(count):
             print("starting test #", i + 1)
-            profile_results = self.profile_once(package, warmup_time, test_time, target_rps, accepted_stats, test_mode)
+            profile_results = self.profile_once(package, warmup_time, test_time, target_rps, accepted_stats, test_mode,
+                                                early_stop_kwargs)
             if all_results is None:
                 all_results = profile_results
             else:
@@ -322,20 +395,23 @@ class Manager(object):
                     all_results[key].append(profile_results[key][0])
 
             # let is get back to the original state
-            time.sleep(30)
+            time.sleep(LoadTester.convert_to_seconds(cooldown))
 
         return all_results
 
-    def profile_once(self, package, warmup_time, test_time, target_rps, accepted_stats, test_mode='RPS'):
+    def profile_once(self, package, warmup_time, test_time, target_rps, accepted_stats, test_mode='RPS',
+                     early_stop_kwargs=None):
+        # early_stop_kwargs, e.g. {'early_stop': 'p95', 'early_stop_width': 0.05}, lets the load tester end
+        # the test before test_time once the statistic is known precisely enough
+        if early_stop_kwargs is None:
+            early_stop_kwargs = {}
         warmup_time_secs = LoadTester.convert_to_seconds(warmup_time)
         test_time_secs = LoadTester.convert_to_seconds(test_time)
-        metric_start_time = 'now-' + test_time
-
-        metricbeatinstance = metricbeat(self.elastic_server_ip, self.elastic_server_port, self.profiler.id)
 
-        def get_statistics():
-            return metricbeatinstance.GetStatistics(start_time=metric_start_time,
-                                                    duration_in_seconds=test_time_secs)
+        def get_statistics(duration_in_seconds=test_time_secs):
+            return self.metrics_backend.GetStatistics(start_time='now-{0}s'.format(int(duration_in_seconds)),
+                                                    duration_in_seconds=duration_in_seconds,
+                                                    server_side=self.server_side_stats)
 
         empty_stats = {}
         stats = get_statistics()
@@ -352,27 +428,38 @@ class Manager(object):
         total_results = empty_results
 
         if test_mode == 'RPS':
-            load_tester = LoadTester.LoadTester(package.test_url, timeout=test_time, warmup=warmup_time)
+            self.check_generator_load(test_mode, target_rps=target_rps)
+            load_tester = self.create_load_tester(package.test_url, timeout=test_time, warmup=warmup_time,
+                                                  **early_stop_kwargs)
             load_tester.perform_test_rps_async(rps=target_rps)
         elif test_mode == 'Interactive':
-            load_tester = LoadTester.LoadTester(package.test_url, timeout=test_time, warmup=warmup_time,
-                                                num_of_clients=target_rps)
+            load_tester = self.create_load_tester(package.test_url, timeout=test_time, warmup=warmup_time,
+                                                  num_of_clients=target_rps, **early_stop_kwargs)
             load_tester.perform_test_async()
 
         else:
             raise Exception("Invalid Test Mode!!!")
 
-        time.sleep(test_time_secs + warmup_time_secs - 1)
+        if early_stop_kwargs.get('early_stop') is not None:
+            # the test may end early, so the metrics window is only known once it is done
+            print('Wating for load tester results...')
+            load_tester.wait_for_test_results()
+            test_results = load_tester.results()
+            stats = get_statistics(max(test_results['elapsed'], 1))
+        else:
+            time.sleep(test_time_secs + warmup_time_secs - 1)
+            stats = get_statistics()
 
-        stats = get_statistics()
+            print('Wating for load tester results...')
+            load_tester.wait_for_test_results()
+            test_results = load_tester.results()
+
+        self.check_generator_load(test_mode, achieved_rps=test_results['rps'])
         for key in stats:
             for key2 in stats[key]:
                 if key2 in accepted_stats:
                     total_stats[key + "-" + key2].append(stats[key][key2])
 
-        print('Wating for load tester results...')
-        load_tester.wait_for_test_results()
-        test_results = load_tester.results()
         for key in test_results:
             total_results[key].append(test_results[key])
 
@@ -380,28 +467,67 @@ class Manager(object):
         return total_results
 
     def get_worker_stats(self, test_time, accepted_stats=None, worker_num=0):
+        return self.get_workers_stats(test_time, accepted_stats, [worker_num])[0]
+
+    def get_workers_stats(self, test_time, accepted_stats=None, worker_nums=None):
         if accepted_stats is None:
             accepted_stats = ['avg']
 
-        total_stats = {}
-        stats = self.get_worker_statistics(test_time, worker_num)
-        for key in stats:
-            for key2 in stats[key]:
-                if key2 in accepted_stats:
-                    total_stats[key + "-" + key2] = stats[key][key2]
+        all_stats = []
+        for stats in self.get_workers_statistics(test_time, worker_nums):
+            total_stats = {}
+            for key in stats:
+                for key2 in stats[key]:
+                    if key2 in accepted_stats:
+                        total_stats[key + "-" + key2] = stats[key][key2]
+            all_stats.append(total_stats)
 
-        return total_stats
+        return all_stats
 
     def get_worker_statistics(self, test_time, worker_num=0):
-        worker = self.workers[worker_num]
-        metric_start_time = 'now-' + test_time
-        test_time_secs = LoadTester.convert_to_seconds(test_time)
+        return self.get_workers_statistics(test_time, [worker_num])[0]
 
-        metricbeatinstance = metricbeat(self.elastic_server_ip, self.elastic_server_port,
-                                        worker.id)
+    def get_workers_statistics(self, test_time, worker_nums=None):
+        # statistics of several workers with one batched query, in the order of worker_nums (all workers by default)
+        if worker_nums is None:
+            worker_nums = range(len(self.workers))
+        hostnames = [self.workers[worker_num].id for worker_num in worker_nums]
+        test_time_secs = LoadTester.convert_to_seconds(test_time)
 
-        return metricbeatinstance.GetStatistics(start_time=metric_start_time,
-                                                duration_in_seconds=test_time_secs)
+        if self.cache_worker_stats and not self.server_side_stats:
+            if self.worker_stats_cache is None or self.worker_stats_cache.window_in_seconds != test_time_secs:
+                self.worker_stats_cache = MetricsCache(self.metrics_backend, test_time_secs)
+            stats = self.worker_stats_cache.GetHostsStatistics(hostnames)
+        else:
+            stats = self.metrics_backend.GetHostsStatistics(hostnames, start_time='now-' + test_time,
+                                                       duration_in_seconds=test_time_secs,
+                                                       server_side=self.server_side_stats)
+        return [stats[hostname] for hostname in hostnames]
+
+    def get_workers_container_statistics(self, test_time, worker_nums=None):
+        # per container statistics of several workers, {container id: stats with its name and image} per worker
+        if worker_nums is None:
+            worker_nums = range(len(self.workers))
+        hostnames = [self.workers[worker_num].id for worker_num in worker_nums]
+        stats = self.metrics_backend.GetHostsContainerStatistics(
+            hostnames, start_time='now-' + test_time, duration_in_seconds=LoadTester.convert_to_seconds(test_time))
+        return [stats[hostname] for hostname in hostnames]
+
+    def get_workers_image_stats(self, test_time, worker_nums=None):
+        # the average of every container metric summed up per image on each worker, so the load can be told apart
+        # by package. Only averages add up, the other statistics of a sum can't be had from the containers' ones
+        all_stats = []
+        for containers in self.get_workers_container_statistics(test_time, worker_nums):
+            image_stats = {}
+            for container in containers.values():
+                total_stats = image_stats.setdefault(container['image'], {})
+                for key in container:
+                    if key in ['name', 'image']:
+                        continue
+                    total_stats[key + "-avg"] = total_stats.get(key + "-avg", 0) + container[key]['avg']
+            all_stats.append(image_stats)
+
+        return all_stats
 
     def get_worker_api(self, worker_num):
         return self.worker_apis[worker_num]
@@ -440,107 +566,173 @@ class Manager(object):
                           device_write_bps=package.device_write_bps, device_write_iops=package.device_write_iops)
 
     def update_worker_stats(self, test_time):
-        self.last_workers_stats = []
-        for idx, worker in enumerate(self.workers):
-            stats = self.get_worker_stats(test_time, worker_num=idx)
-            self.last_workers_stats.append(stats)
+        self.last_workers_stats = self.get_workers_stats(test_time)
 
     def perform_experiment(self, packages, package_sequences, package_max_latencies, sequence_len,
                            test_time='1m', warmup_time='10s',
-                           package_selection_method='random'):
+                           package_selection_method='random', latency_stat='avg_ms', continuous=False, session=None,
+                           mixed=False):
+        # latency_stat picks which LoadTester result is checked against package_max_latencies,
+        # e.g. 'p99_ms' to place by tail latency instead of the mean.
+        # With continuous=True one LoadTester per package runs through the whole sequence, its client count
+        # is changed at every time step and each step is measured with snapshot(), so warmup is paid only once.
+        # session (a UserSession.SessionModel) adds think times, so package_sequences count users instead of
+        # concurrent requests.
+        # With mixed=True every time step runs a single LoadTester over the URL mix of all packages, each package
+        # gets its share of the users and is measured separately on the same clock
+        if mixed and continuous:
+            raise Exception('Mixed and continuous experiments cannot be combined!')
+        if mixed and len(set([package.test_url for package in packages])) != len(packages):
+            raise Exception('Mixed experiments need a different test_url for every package!')
         test_time_secs = LoadTester.convert_to_seconds(test_time)
         warmup_time_secs = LoadTester.convert_to_seconds(warmup_time)
+        ITERATION_REPEAT_LIMIT = 3
 
         # For initial status
         self.update_worker_stats(test_time)
 
-        results = []
-        for time_step in range(sequence_len):
-            print('++++++++++++++++++++++++++')
-            print('time step #', time_step)
-
-            valid_test = False
-            first_time = True
-            test_results = {}
-            result = {}
-            package_load_testers = []
-
-            retry_count = 0
-            ITERATION_REPEAT_LIMIT = 3
-            while not valid_test:
-                result = {
-                    'time': time_step,
-                }
-
-                package_load_testers = []
+        continuous_load_testers = []
+        try:
+            if continuous:
+                # snapshot() and live client changes are only available on a local LoadTester
                 for idx, package in enumerate(packages):
-                    load_tester = LoadTester.LoadTester(package.test_url, timeout=test_time, warmup=warmup_time,
-                                                        num_of_clients=package_sequences[idx][time_step])
+                    load_tester = LoadTester.LoadTester(package.test_url, timeout='24h', warmup=warmup_time,
+                                                        num_of_clients=package_sequences[idx][0], session=session)
                     load_tester.perform_test_async()
-                    package_load_testers.append(load_tester)
-
-                time.sleep(test_time_secs + warmup_time_secs - 1)
-
-                # Gather the worker stats
-                self.update_worker_stats(test_time)
-
-                total_valid_test = True
-                for idx, load_tester in enumerate(package_load_testers):
-                    load_tester.stop_test()
-                    load_tester.prepare_results()
-                    test_results = load_tester.results()
-                    print(load_tester.url)
-                    load_tester.print_results()
+                    continuous_load_testers.append(load_tester)
+                time.sleep(warmup_time_secs)
+
+            results = []
+            for time_step in range(sequence_len):
+                print('++++++++++++++++++++++++++')
+                print('time step #', time_step)
+
+                valid_test = False
+                first_time = True
+                test_results = {}
+                result = {}
+                package_load_testers = []
 
-                    if test_results['avg_ms'] < package_max_latencies[idx] and test_results['completed'] > 20:
-                        valid_test = True
+                retry_count = 0
+                while not valid_test:
+                    result = {
+                        'time': time_step,
+                    }
+
+                    if continuous:
+                        package_load_testers = continuous_load_testers
+                        for idx, load_tester in enumerate(package_load_testers):
+                            load_tester.set_num_of_clients(package_sequences[idx][time_step])
+                            # start measuring this step from here
+                            load_tester.snapshot()
+
+                        time.sleep(test_time_secs - 1)
+                    elif mixed:
+                        url_mix = collections.OrderedDict()
+                        for idx, package in enumerate(packages):
+                            url_mix[package.test_url] = package_sequences[idx][time_step]
+                        load_tester = self.create_load_tester(url_mix, timeout=test_time, warmup=warmup_time,
+                                                              num_of_clients=sum(url_mix.values()), session=session,
+                                                              endpoint_mix='user')
+                        load_tester.perform_test_async()
+                        package_load_testers = [load_tester]
+
+                        time.sleep(test_time_secs + warmup_time_secs - 1)
                     else:
-                        available_worker_nums, total_counts = self.get_available_workers()
-                        if len(available_worker_nums) > 0:
-                            self.add_package(packages[idx], package_selection_method=package_selection_method)
-                            valid_test = False
+                        package_load_testers = []
+                        for idx, package in enumerate(packages):
+                            load_tester = self.create_load_tester(package.test_url, timeout=test_time,
+                                                                  warmup=warmup_time,
+                                                                  num_of_clients=package_sequences[idx][time_step],
+                                                                  session=session)
+                            load_tester.perform_test_async()
+                            package_load_testers.append(load_tester)
+
+                        time.sleep(test_time_secs + warmup_time_secs - 1)
+
+                    # Gather the worker stats
+                    self.update_worker_stats(test_time)
+
+                    total_valid_test = True
+                    package_results = []
+                    if mixed:
+                        mixed_load_tester = package_load_testers[0]
+                        mixed_load_tester.stop_test()
+                        # a merged tester only has the shards' final summaries once they are collected
+                        mixed_load_tester.wait_for_test_results()
+                        mixed_load_tester.print_results()
+                        mixed_results = mixed_load_tester.endpoint_results()
+                    for idx, package in enumerate(packages):
+                        print(package.test_url)
+                        if mixed:
+                            test_results = mixed_results[package.test_url]
+                            print(test_results)
+                        elif continuous:
+                            load_tester = package_load_testers[idx]
+                            test_results = load_tester.snapshot()
+                            print(test_results)
                         else:
+                            load_tester = package_load_testers[idx]
+                            load_tester.stop_test()
+                            load_tester.wait_for_test_results()
+                            test_results = load_tester.results()
+                            load_tester.print_results()
+                        package_results.append(test_results)
+
+                        if test_results[latency_stat] < package_max_latencies[idx] and test_results['completed'] > 20:
                             valid_test = True
-                    if not valid_test:
-                        total_valid_test=False
-
-                    for key in test_results:
-                        result[packages[idx].image_name + "-" + key] = test_results[key]
+                        else:
+                            available_worker_nums, total_counts = self.get_available_workers()
+                            if len(available_worker_nums) > 0:
+                                self.add_package(packages[idx], package_selection_method=package_selection_method)
+                                valid_test = False
+                            else:
+                                valid_test = True
+                        if not valid_test:
+                            total_valid_test=False
+
+                        for key in test_results:
+                            result[packages[idx].image_name + "-" + key] = test_results[key]
                         
-                valid_test = total_valid_test
+                    valid_test = total_valid_test
 
-                first_time = False
+                    # all packages share the generator
+                    achieved_rps = sum([test_results['rps'] for test_results in package_results])
+                    self.check_generator_load('Interactive', achieved_rps=achieved_rps)
 
-                for load_tester in package_load_testers:
-                    test_results = load_tester.results()
-                    if test_results['avg_ms'] == 0 or test_results['completed'] < 20:
-                        print('Bad Average or Too little completed tasks!')
-                        valid_test = False
-                        first_time = True
+                    first_time = False
 
-                for idx, package in enumerate(packages):
-                    package_count = 0
-                    for worker_num, worker in enumerate(self.workers):
-                        package_count += self.worker_package_counts[worker_num][package.image_name]
-                    result[package.image_name + "-count"] = package_count
+                    for test_results in package_results:
+                        if test_results['avg_ms'] == 0 or test_results['completed'] < 20:
+                            print('Bad Average or Too little completed tasks!')
+                            valid_test = False
+                            first_time = True
 
-                    result[package.image_name + "-user_count"] = package_sequences[idx][time_step]
+                    for idx, package in enumerate(packages):
+                        package_count = 0
+                        for worker_num, worker in enumerate(self.workers):
+                            package_count += self.worker_package_counts[worker_num][package.image_name]
+                        result[package.image_name + "-count"] = package_count
+
+                        result[package.image_name + "-user_count"] = package_sequences[idx][time_step]
+
+                    retry_count += 1
+                    # Let it end in the end, even if we don't get to where we want!
+                    if retry_count > (ITERATION_REPEAT_LIMIT - 1):
+                        print('This iteration never converged!!!')
+                        valid_test = True
 
-                retry_count += 1
-                # Let it end in the end, even if we don't get to where we want!
                 if retry_count > (ITERATION_REPEAT_LIMIT - 1):
                     print('This iteration never converged!!!')
-                    valid_test = True
-
-            if retry_count > (ITERATION_REPEAT_LIMIT - 1):
-                print('This iteration never converged!!!')
-            else:
-                for load_tester in package_load_testers:
-                    test_results = load_tester.results()
-                    if test_results['avg_ms'] == 0 or test_results['completed'] < 20:
-                        raise Exception("Zero latency reported! something went wrong!")
-            print(result)
-            results.append(result)
+                else:
+                    for test_results in package_results:
+                        if test_results['avg_ms'] == 0 or test_results['completed'] < 20:
+                            raise Exception("Zero latency reported! something went wrong!")
+                print(result)
+                results.append(result)
+        finally:
+            for load_tester in continuous_load_testers:
+                load_tester.stop_test()
 
         return results
 
@@ -0,0 +1,80 @@
+"""
+Node statistics straight from the /proc collector of each node's API, instead of Metricbeat and Elasticsearch.
+
+The collector keeps the last hour of samples in memory under GET /metrics, so statistics are as fresh as
+its sampling interval. ProcMetrics is a drop-in for ELSbeat.metricbeat, only the way samples are fetched
+differs, e.g. Manager(..., metrics_backend='proc').
+"""
+import concurrent.futures
+
+import numpy as np
+import requests
+
+import LoadTester
+from ELSbeat import metricbeat
+
+
+class ProcMetrics(metricbeat):
+    def __init__(self, api_urls, worker_node_hostname=None, period=5, max_gap=2.5, timeout=10):
+        super(ProcMetrics, self).__init__(None, None, worker_node_hostname, period=period, max_gap=max_gap)
+        # api_urls maps every hostname to the base url of its node API
+        self.api_urls = api_urls
+        self.timeout = timeout
+        # sampling interval each node's collector reports with its samples, period is used until it has
+        self.host_periods = {}
+
+    def FetchSamples(self, keys, start_time="now-1m", search_after=None):
+        # one GET /metrics per host, all hosts at once. The last sort value of a key is its last timestamp
+        window = LoadTester.convert_to_seconds(start_time[len("now-"):])
+        hostnames = []
+        for hostname, item in keys:
+            if hostname not in hostnames:
+                hostnames.append(hostname)
+
+        def fetch(hostname):
+            since = None
+            if search_after is not None:
+                known = [search_after[key] for key in keys if key[0] == hostname and search_after.get(key)]
+                since = min(known) if known else None
+            params = {"window": window}
+            if since is not None:
+                params["since"] = since
+            try:
+                resp = requests.get(self.api_urls[hostname] + "/metrics", params=params, timeout=self.timeout)
+                data = resp.json()
+                if data.get("period"):
+                    self.host_periods[hostname] = float(data["period"])
+                return data["metricsets"]
+            except (requests.exceptions.RequestException, ValueError, KeyError):
+                return None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(hostnames), 1)) as executor:
+            metricsets = dict(zip(hostnames, executor.map(fetch, hostnames)))
+
+        res = {}
+        for hostname, item in keys:
+            if metricsets[hostname] is None or item not in metricsets[hostname]:
+                res[(hostname, item)] = None
+                continue
+            data = metricsets[hostname][item]
+            timestamps = np.array(data["timestamps"], dtype=float)
+            after = None if search_after is None else search_after.get((hostname, item))
+            keep = timestamps > after if after is not None else np.ones(timestamps.shape[0], dtype=bool)
+            columns = [data["fields"].index(field) for field in self.MetricsetFields(item)]
+            samples = np.array(data["samples"], dtype=float).reshape(-1, len(data["fields"]))[:, columns]
+            last = timestamps[keep][-1] if keep.any() else after
+            res[(hostname, item)] = (timestamps[keep], samples[keep], last)
+        return res
+
+    def HostPeriod(self, hostname):
+        # max_gap is in periods, so a node sampling more slowly also tolerates longer gaps
+        return self.host_periods.get(hostname, self.period)
+
+    def GetHostsStatistics(self, hostnames, start_time="now-1m", duration_in_seconds=0, wait=False,
+                           server_side=False, interval="5s"):
+        # there is nothing to aggregate on, server_side is ignored
+        return super(ProcMetrics, self).GetHostsStatistics(hostnames, start_time, duration_in_seconds, wait)
+
+    def GetHostsContainerStatistics(self, hostnames, start_time="now-1m", duration_in_seconds=0, wait=False):
+        # the node collector only samples the host, there are no per container statistics
+        return {hostname: {} for hostname in hostnames}
@@ -0,0 +1,128 @@
+import math
+import random
+
+
+class ConstantThinkTime(object):
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.mean = seconds
+
+    def sample(self, rng):
+        return self.seconds
+
+    def spec(self):
+        return {'distribution': 'constant', 'kwargs': {'seconds': self.seconds}}
+
+
+class ExponentialThinkTime(object):
+    def __init__(self, mean):
+        self.mean = mean
+
+    def sample(self, rng):
+        return rng.expovariate(1.0 / self.mean) if self.mean > 0 else 0
+
+    def spec(self):
+        return {'distribution': 'exponential', 'kwargs': {'mean': self.mean}}
+
+
+class UniformThinkTime(object):
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+        self.mean = (low + high) / 2.0
+
+    def sample(self, rng):
+        return rng.uniform(self.low, self.high)
+
+    def spec(self):
+        return {'distribution': 'uniform', 'kwargs': {'low': self.low, 'high': self.high}}
+
+
+class LogNormalThinkTime(object):
+    """Heavy tailed think times, `mean` is the mean of the think time itself, not of its log."""
+    def __init__(self, mean, sigma=1.0):
+        self.mean = mean
+        self.sigma = sigma
+        self.mu = math.log(mean) - sigma ** 2 / 2.0
+
+    def sample(self, rng):
+        return rng.lognormvariate(self.mu, self.sigma)
+
+    def spec(self):
+        return {'distribution': 'lognormal', 'kwargs': {'mean': self.mean, 'sigma': self.sigma}}
+
+
+def create_think_time(distribution, **kwargs):
+    if distribution == 'constant':
+        return ConstantThinkTime(**kwargs)
+    elif distribution == 'exponential':
+        return ExponentialThinkTime(**kwargs)
+    elif distribution == 'uniform':
+        return UniformThinkTime(**kwargs)
+    elif distribution == 'lognormal':
+        return LogNormalThinkTime(**kwargs)
+    else:
+        raise Exception("Invalid Think Time Distribution!!!")
+
+
+def think_time_from_spec(spec):
+    if spec is None:
+        return None
+    return create_think_time(spec['distribution'], **spec['kwargs'])
+
+
+class SessionModel(object):
+    """What a virtual user does between its requests in Interactive mode.
+
+    A user sends `requests_per_session` requests with a `think_time` pause after each of them,
+    then waits `session_gap` (think_time when not given) and starts its next session, like a new
+    visitor taking its place. With geometric=True the session length is random with that mean.
+    """
+    def __init__(self, think_time=None, requests_per_session=1, session_gap=None, geometric=False, seed=None):
+        self.think_time = think_time
+        self.requests_per_session = requests_per_session
+        self.session_gap = session_gap
+        self.geometric = geometric
+        self.seed = seed
+
+    def session_length(self, rng):
+        if not self.geometric or self.requests_per_session <= 1:
+            return self.requests_per_session
+        # number of trials until the first success, mean 1/p
+        return int(math.log(1.0 - rng.random()) / math.log(1.0 - 1.0 / self.requests_per_session)) + 1
+
+    def pause(self, distribution, rng):
+        return 0 if distribution is None else distribution.sample(rng)
+
+    def pauses(self, user_id=0):
+        # seconds to wait after each request of the user
+        rng = random.Random(None if self.seed is None else '{0}-{1}'.format(self.seed, user_id))
+        while True:
+            for i in range(self.session_length(rng) - 1):
+                yield self.pause(self.think_time, rng)
+            yield self.pause(self.session_gap if self.session_gap is not None else self.think_time, rng)
+
+    def cycle_time(self):
+        # mean pause per request, a user sends about 1 / (latency + cycle_time()) requests per second
+        think = 0 if self.think_time is None else self.think_time.mean
+        gap = think if self.session_gap is None else self.session_gap.mean
+        return (think * (self.requests_per_session - 1) + gap) / self.requests_per_session
+
+    def spec(self):
+        return {
+            'think_time': None if self.think_time is None else self.think_time.spec(),
+            'requests_per_session': self.requests_per_session,
+            'session_gap': None if self.session_gap is None else self.session_gap.spec(),
+            'geometric': self.geometric,
+            'seed': self.seed,
+        }
+
+
+def session_from_spec(spec):
+    # inverse of SessionModel.spec(), used to ship sessions to shards and load agents as JSON
+    if spec is None:
+        return None
+    return SessionModel(think_time=think_time_from_spec(spec['think_time']),
+                        requests_per_session=spec['requests_per_session'],
+                        session_gap=think_time_from_spec(spec['session_gap']),
+                        geometric=spec['geometric'], seed=spec['seed'])